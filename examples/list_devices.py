@@ -4,6 +4,6 @@ from zenoss import Zenoss
 
 zenoss = Zenoss('http://zenoss:8080/', 'admin', 'password')
 
-for device in zenoss.get_devices()['devices']:
+for device in zenoss.get_devices(keys=['name'])['devices']:
     print(device['name'])
 
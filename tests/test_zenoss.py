@@ -1,8 +1,21 @@
 import unittest
 
+import os
 import re
+import json
+import shutil
+import subprocess
+import sys
 import logging
-from zenoss import Zenoss
+import tempfile
+import threading
+import time
+
+import requests
+from zenoss import Zenoss, Device, InventorySnapshot, write_snapshot, diff_snapshots, DeviceRecord, EventRecord
+from zenoss import iter_json_array, ZenossException, DeviceNotFound, RetryPolicy
+from zenoss import RouterClient, DeviceRouterClient, EventsRouterClient, PropertiesRouterClient
+from zenoss import TriggerRuleEngine, EventAggregator, InventoryIndex, MetadataCache, SingleFlight, RequestScheduler, PRIORITY_BULK, PRIORITY_INTERACTIVE, PRIORITY_WRITE, PRIORITY_READ
 from httmock import HTTMock, urlmatch
 
 
@@ -23,8 +36,17 @@ def mocked_evconsole_router(request):
     return {'status_code': 200, 'content': {'result': {'totalCount': 1, 'success': True, 'events': events}}}
 
 
+def mocked_properties_router(url):
+    # Device classes carry their own timeout, locally overridden devices carry 5
+    timeout = 5 if '/devices/' in url.path else len(url.path)
+    props = [{'id': 'zCollectorClientTimeout', 'islocal': 0, 'path': '/', 'value': timeout}]
+    return {'status_code': 200, 'content': {'result': {'success': True, 'data': props}}}
+
+
 @urlmatch(path='.*router$')
 def response_content(url, request):
+    if re.search('properties_router', url.path):
+        return mocked_properties_router(url)
     if re.search('device_router', url.path):
         return mocked_device_router(request)
     if re.search('evconsole_router', url.path):
@@ -40,12 +62,138 @@ class TestZenoss(unittest.TestCase):
             result = self.api.get_devices()
             self.assertTrue(result['success'])
 
+    def test_internal_lookups_project_keys(self):
+        bodies = []
+
+        @urlmatch(path='.*device_router$')
+        def recording(url, request):
+            bodies.append(json.loads(request.body)[0])
+            return mocked_device_router(request)
+
+        with HTTMock(recording):
+            self.api.set_prod_state(TEST_SERVERNAME, 300)
+        self.assertEqual(bodies[0]['method'], 'getDevices')
+        self.assertEqual(bodies[0]['data'][0]['keys'], ['uid', 'name'])
+        self.assertEqual(bodies[0]['data'][0]['params'], {'name': TEST_SERVERNAME})
+        self.assertEqual(bodies[0]['data'][0]['limit'], 50)
+        self.assertEqual(bodies[1]['data'][0]['uids'], ['123'])
+
+    def test_find_devices(self):
+        with HTTMock(response_content):
+            found = self.api.find_devices([TEST_SERVERNAME, 'missing.com'])
+        self.assertEqual(list(found), [TEST_SERVERNAME])
+        self.assertEqual(found[TEST_SERVERNAME]['hash'], '123')
+        with HTTMock(response_content):
+            found = self.api.find_devices([TEST_SERVERNAME, 'missing.com'], scan_above=1)
+        self.assertEqual(list(found), [TEST_SERVERNAME])
+
+    def test_find_devices_errors(self):
+        @urlmatch(path='.*device_router$')
+        def login_page(url, request):
+            return {'status_code': 200, 'content': '<input name="__ac_name">'}
+
+        with HTTMock(login_page):
+            self.assertRaises(ZenossException, self.api.find_devices, ['web01', 'web02'])
+        with HTTMock(response_content):
+            self.assertRaises(DeviceNotFound, self.api.find_device, 'missing.com')
+
+    def test_device_handle(self):
+        calls = []
+
+        @urlmatch(path='.*device_router$')
+        def counting(url, request):
+            calls.append(json.loads(request.body)[0]['method'])
+            device = {'name': TEST_SERVERNAME, 'uid': '/zport/dmd/Devices/Server/devices/' + TEST_SERVERNAME,
+                      'hwManufacturer': {'name': 'Dell'}, 'hwModel': {'name': 'R630'}}
+            result = {'totalCount': 1, 'success': True, 'hash': '123', 'devices': [device]}
+            return {'status_code': 200, 'content': {'result': result}}
+
+        with HTTMock(counting):
+            device = self.api.device(TEST_SERVERNAME)
+            device.set_rhel_release(7.9)
+            device.move('/zport/dmd/Devices/Server/Linux')
+            self.api.set_collector(device.uid, 'remote1')
+        self.assertEqual(calls, ['getDevices', 'setProductInfo', 'moveDevices', 'setCollector'])
+        self.assertEqual(device.uid, '/zport/dmd/Devices/Server/Linux/devices/' + TEST_SERVERNAME)
+
+    def test_device_dicts(self):
+        bodies = []
+
+        @urlmatch(path='.*device_router$')
+        def recording(url, request):
+            bodies.append(json.loads(request.body)[0])
+            return mocked_device_router(request)
+
+        with HTTMock(recording):
+            device = self.api.get_devices()['devices'][0]
+            self.api.remove_device(device)
+            self.api.set_prod_state(device, 300)
+        self.assertEqual([body['method'] for body in bodies], ['getDevices', 'removeDevices', 'setProductionState'])
+        self.assertEqual(bodies[1]['data'][0]['uids'], ['123'])
+        self.assertEqual(bodies[1]['data'][0]['hashcheck'], None)
+        self.assertFalse('hash' in device)
+
+    def test_create_event_device_types(self):
+        sent = []
+
+        @urlmatch(path='.*evconsole_router$')
+        def recording(url, request):
+            actions = json.loads(request.body)
+            sent.extend(action['data'][0]['device'] for action in actions)
+            response = batch_content(url, request)
+            if len(actions) == 1:
+                response['content'] = response['content'][0]
+            return response
+
+        uid = '/zport/dmd/Devices/Server/devices/' + TEST_SERVERNAME
+        devices = [TEST_SERVERNAME, uid, Device(self.api, {'name': TEST_SERVERNAME, 'uid': uid}),
+                   {'name': TEST_SERVERNAME, 'uid': uid}, {'uid': uid}]
+        with HTTMock(recording):
+            for device in devices:
+                self.assertTrue(self.api.create_event_on_device(device, 'Error', 'disk full')['success'])
+            with self.api.event_writer(flush_interval=60) as writer:
+                futures = [writer.create_event_on_device(device, 'Error', 'disk full') for device in devices]
+        self.assertTrue(all(future.result()['success'] for future in futures))
+        self.assertEqual(sent, [TEST_SERVERNAME] * 10)
+
     def test_get_events(self):
         with HTTMock(response_content):
             result = self.api.get_events()
             self.assertTrue(type(result is list))
             self.assertTrue('count' in result[0])
 
+    def test_get_devices_if_changed(self):
+        with HTTMock(response_content):
+            self.assertEqual(self.api.get_devices_hash(), '123')
+            self.assertTrue(self.api.get_devices_if_changed('123', keys=['uid']) is None)
+            result = self.api.get_devices_if_changed('456', keys=['uid'])
+        self.assertEqual(result['hash'], '123')
+
+    def test_get_devices_records(self):
+        with HTTMock(response_content):
+            result = self.api.get_devices(records=True)
+        device = result['devices'][0]
+        self.assertTrue(isinstance(device, DeviceRecord))
+        self.assertEqual(device.name, TEST_SERVERNAME)
+        self.assertEqual(device['uid'], '123')
+        self.assertEqual(device.to_dict(), {'name': TEST_SERVERNAME, 'uid': '123'})
+        self.assertRaises(AttributeError, setattr, device, 'name', 'other')
+
+    def test_get_events_records(self):
+        with HTTMock(response_content):
+            events = self.api.get_events(records=True)
+        self.assertTrue(isinstance(events[0], EventRecord))
+        self.assertEqual(events[0].count, 0)
+        self.assertEqual(events[0].get('evid'), {'success': True})
+        self.assertEqual(events[0].to_dict(), {'count': 0, 'evid': {'success': True}})
+
+    def test_record_rest_fields(self):
+        device = DeviceRecord({'uid': '1', 'deviceClass': {'uid': '/zport/dmd/Devices/Server'}})
+        self.assertEqual(device.deviceClass['uid'], '/zport/dmd/Devices/Server')
+        self.assertTrue('deviceClass' in device)
+        self.assertFalse('name' in device)
+        self.assertRaises(KeyError, lambda: device['name'])
+
     def test_add_device(self):
         with HTTMock(response_content):
             result = self.api.add_device(TEST_SERVERNAME, '/Devices/Server/Linux')
@@ -72,6 +220,763 @@ class TestZenoss(unittest.TestCase):
             if len(events) > 0:
                 self.assertTrue(self.api.close_event(events[0]['evid'])['success'])
 
+    def test_reconcile_devices_dry_run(self):
+        desired = {TEST_SERVERNAME: {'collector': 'remote1', 'prod_state': 300, 'device_class': '/Server/Linux'},
+                   'missing.com': {'prod_state': 1000}}
+        with HTTMock(response_content):
+            plan = self.api.reconcile_devices(desired, dry_run=True)
+        self.assertEqual(plan['missing'], ['missing.com'])
+        self.assertEqual([a['method'] for a in plan['actions']],
+                         ['setCollector', 'setProductionState', 'moveDevices'])
+        self.assertEqual(plan['actions'][-1]['data']['target'], '/zport/dmd/Devices/Server/Linux')
+        self.assertTrue(all('result' not in a for a in plan['actions']))
+
+    def test_reconcile_devices(self):
+        with HTTMock(response_content):
+            plan = self.api.reconcile_devices({TEST_SERVERNAME: {'collector': 'remote1'}})
+        self.assertEqual(len(plan['actions']), 1)
+        self.assertTrue(plan['actions'][0]['result']['success'])
+
+    def test_reconcile_devices_updates_index(self):
+        device = {'name': TEST_SERVERNAME, 'uid': '/zport/dmd/Devices/Server/devices/' + TEST_SERVERNAME, 'groups': []}
+
+        @urlmatch(path='.*device_router$')
+        def inventory(url, request):
+            body = json.loads(request.body)[0]
+            data = body['data'][0]
+            if body['method'] == 'moveDevices' and data['target'].startswith('/zport/dmd/Groups'):
+                device['groups'] = [{'uid': data['target'], 'name': data['target'].rsplit('/', 1)[-1]}]
+            elif body['method'] == 'moveDevices':
+                device['uid'] = data['target'] + '/devices/' + TEST_SERVERNAME
+            result = {'totalCount': 1, 'success': True, 'hash': '1', 'devices': [dict(device)]}
+            return {'status_code': 200, 'content': {'result': result}}
+
+        with HTTMock(inventory):
+            index = self.api.build_inventory_index()
+            self.api.reconcile_devices({TEST_SERVERNAME: {'groups': ['/Web'], 'device_class': '/Server/Linux'}})
+        self.assertEqual([d['uid'] for d in index.by_group('/Web')], [device['uid']])
+        self.assertEqual(len(index.by_device_class('/Server/Linux')), 1)
+        self.assertEqual(len(index), 1)
+
+    def test_get_zproperty_values(self):
+        linux = '/zport/dmd/Devices/Server/Linux'
+        uids = [linux + '/devices/web%02d' % i for i in range(10)]
+        calls = []
+
+        @urlmatch(path='.*properties_router$')
+        def counting(url, request):
+            method = json.loads(request.body)[0]['method']
+            calls.append((method, url.path))
+            if method == 'getOverriddenObjectsList':
+                return {'status_code': 200, 'content': {'result': {'success': True, 'data': [{'uid': uids[3]}]}}}
+            return mocked_properties_router(url)
+
+        with HTTMock(counting):
+            values = self.api.get_zproperty_values(uids, 'zCollectorClientTimeout', local_overrides=uids[:1])
+            self.api.get_zproperty_values(uids[5:], ['zCollectorClientTimeout'])
+            details = self.api.get_zproperty_values(uids[3:5], 'zCollectorClientTimeout', details=True)
+        self.assertEqual(sorted(calls), [('getOverriddenObjectsList', linux + '/properties_router'),
+                                         ('getZenProperties', uids[0] + '/properties_router'),
+                                         ('getZenProperties', uids[3] + '/properties_router'),
+                                         ('getZenProperties', linux + '/properties_router')])
+        self.assertEqual(values[uids[0]], {'zCollectorClientTimeout': 5})
+        self.assertEqual(values[uids[3]], {'zCollectorClientTimeout': 5})
+        self.assertEqual(values[uids[1]]['zCollectorClientTimeout'], len(linux + '/properties_router'))
+        self.assertTrue(details[uids[4]]['zCollectorClientTimeout']['inherited'])
+        self.assertEqual(details[uids[3]]['zCollectorClientTimeout']['value'], 5)
+
+    def test_get_zproperty_values_without_override_listing(self):
+        @urlmatch(path='.*properties_router$')
+        def unsupported(url, request):
+            if json.loads(request.body)[0]['method'] == 'getOverriddenObjectsList':
+                return {'status_code': 500, 'content': ''}
+            return mocked_properties_router(url)
+
+        uid = '/zport/dmd/Devices/Server/Linux/devices/web01'
+        with HTTMock(unsupported):
+            values = self.api.get_zproperty_values([uid], 'zCollectorClientTimeout', details=True)
+        self.assertEqual(values[uid]['zCollectorClientTimeout']['inherited'], True)
+        self.assertEqual(values[uid]['zCollectorClientTimeout']['islocal'], False)
+
+TREE = {'/zport/dmd/Devices': ['/zport/dmd/Devices/Server', '/zport/dmd/Devices/Network'],
+        '/zport/dmd/Devices/Server': ['/zport/dmd/Devices/Server/Linux'],
+        '/zport/dmd/Devices/Server/Linux': [],
+        '/zport/dmd/Devices/Network': []}
+
+
+@urlmatch(path='.*device_router$')
+def tree_content(url, request):
+    body = json.loads(request.body)[0]
+    if body['method'] == 'asyncGetTree':
+        children = [{'uid': uid, 'text': {'text': uid.rsplit('/', 1)[-1], 'count': 0}, 'leaf': False}
+                    for uid in TREE[body['data'][0]]]
+        return {'status_code': 200, 'content': {'result': children}}
+    return {'status_code': 200, 'content': {'result': {'success': True}}}
+
+
+class TestOrganizerTree(unittest.TestCase):
+    def setUp(self):
+        self.api = Zenoss('http://zenoss:8080', 'admin', 'password')
+
+    def test_crawl_organizer_tree(self):
+        with HTTMock(tree_content):
+            tree = self.api.crawl_organizer_tree()
+        self.assertEqual(len(tree), 4)
+        self.assertEqual(tree.find('/Server/Linux')['uid'], '/zport/dmd/Devices/Server/Linux')
+        self.assertEqual([n['name'] for n in tree.children('/zport/dmd/Devices')], ['Server', 'Network'])
+
+    def test_get_organizer_tree_refreshes_changed_subtree(self):
+        with HTTMock(tree_content):
+            tree = self.api.get_organizer_tree()
+            TREE['/zport/dmd/Devices/Network'] = ['/zport/dmd/Devices/Network/Router']
+            TREE['/zport/dmd/Devices/Network/Router'] = []
+            try:
+                self.api.add_device_class('Router', path='/Network')
+                self.assertEqual(tree.dirty, set(['/zport/dmd/Devices/Network']))
+                self.assertTrue(self.api.get_organizer_tree() is tree)
+            finally:
+                TREE['/zport/dmd/Devices/Network'] = []
+        self.assertEqual(tree.find('/Network/Router')['parent'], '/zport/dmd/Devices/Network')
+        self.assertFalse(tree.dirty)
+
+    def test_read_during_organizer_write(self):
+        @urlmatch(path='.*device_router$')
+        def slow_write(url, request):
+            if json.loads(request.body)[0]['method'] == 'addDeviceClassNode':
+                # Another reader refreshes the tree before the server applies the write
+                self.api.get_organizer_tree()
+                TREE['/zport/dmd/Devices/Network'] = ['/zport/dmd/Devices/Network/Router']
+                TREE['/zport/dmd/Devices/Network/Router'] = []
+            return tree_content(url, request)
+
+        with HTTMock(slow_write):
+            self.api.get_organizer_tree()
+            try:
+                self.api.add_device_class('Router', path='/Network')
+                tree = self.api.get_organizer_tree()
+            finally:
+                TREE['/zport/dmd/Devices/Network'] = []
+        self.assertTrue('/zport/dmd/Devices/Network/Router' in tree)
+
+
+class TestStreaming(unittest.TestCase):
+    def setUp(self):
+        self.api = Zenoss('http://zenoss:8080', 'admin', 'password')
+
+    def test_iter_json_array(self):
+        doc = {'result': {'summary': 'say "events": [1]', 'events': [{'n': u'caf\u00e9'}, 123, [1, 2], 'x'],
+                          'totalCount': 4}, 'tid': 1}
+        raw = json.dumps(doc).encode('utf-8')
+        chunks = [raw[i:i + 1] for i in range(len(raw))]
+        self.assertEqual(list(iter_json_array(chunks, 'events')), [{'n': u'caf\u00e9'}, 123, [1, 2], 'x'])
+
+    def test_iter_json_array_errors(self):
+        self.assertRaises(ZenossException, list, iter_json_array([b'<input name="__ac_name">'], 'events'))
+        self.assertRaises(ZenossException, list, iter_json_array([b'{"events": [1, {"a"'], 'events'))
+        self.assertRaises(ZenossException, list, iter_json_array([b'{"devices": []}'], 'events'))
+
+    def test_iter_devices_and_events(self):
+        with HTTMock(response_content):
+            devices = list(self.api.iter_devices(keys=['uid', 'name']))
+            events = list(self.api.iter_events(records=True))
+        self.assertEqual(devices, [{'name': TEST_SERVERNAME, 'uid': '123'}])
+        self.assertEqual(events[0].count, 0)
+
+
+class TestEventTransforms(unittest.TestCase):
+    def setUp(self):
+        self.api = Zenoss('http://zenoss:8080', 'admin', 'password')
+        self.transforms = {'/zport/dmd/Events/Net/instances/a': 'evt.severity = 2\n',
+                           '/zport/dmd/Events/Net/BGP/instances/b': 'evt.summary = "x"'}
+        self.written = []
+
+    def router(self, url, request):
+        replies = []
+        for action in json.loads(request.body):
+            data = action['data'][0]
+            if action['method'] == 'asyncGetTree':
+                result = [{'uid': '/zport/dmd/Events/Net/BGP', 'text': {'text': 'BGP'}, 'leaf': True}] \
+                    if data == '/zport/dmd/Events/Net' else []
+            elif action['method'] == 'getInstances':
+                result = {'data': [{'uid': uid, 'hasTransform': True} for uid in self.transforms
+                                   if uid.rsplit('/instances/', 1)[0] == data['uid']]}
+            elif action['method'] == 'getTransform':
+                result = {'success': True, 'data': self.transforms.get(data['uid'])}
+            else:
+                self.written.append(data['uid'])
+                self.transforms[data['uid']] = data.get('transform')
+                result = {'success': True}
+            replies.append({'tid': action['tid'], 'type': 'rpc', 'result': result})
+        return {'status_code': 200, 'content': replies[0] if len(replies) == 1 else replies}
+
+    def test_export_event_transforms(self):
+        with HTTMock(urlmatch(path='.*evclasses_router$')(self.router)):
+            self.assertEqual(self.api.export_event_transforms('/Net'), self.transforms)
+
+    def test_sync_event_transforms(self):
+        wanted = {'/Net/instances/a': 'evt.severity = 2\r\n\n',
+                  '/Net/BGP/instances/b': 'evt.summary = "y"',
+                  '/zport/dmd/Events/Net/BGP/instances/c': 'pass'}
+        with HTTMock(urlmatch(path='.*evclasses_router$')(self.router)):
+            plan = self.api.sync_event_transforms(wanted, dry_run=True)
+            self.assertEqual([c['uid'] for c in plan], ['/zport/dmd/Events/Net/BGP/instances/b',
+                                                        '/zport/dmd/Events/Net/BGP/instances/c'])
+            self.assertTrue('+evt.summary = "y"' in plan[0]['diff'])
+            self.assertEqual(self.written, [])
+            changes = self.api.sync_event_transforms(wanted)
+        self.assertEqual(self.written, [c['uid'] for c in plan])
+        self.assertTrue(all(c['result']['success'] for c in changes))
+
+    def test_sync_past_metadata_cache(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        api = Zenoss('http://zenoss:8080', 'admin', 'password', metadata_cache=MetadataCache(directory))
+        uid = '/zport/dmd/Events/Net/instances/a'
+        with HTTMock(urlmatch(path='.*evclasses_router$')(self.router)):
+            self.assertEqual(api.get_ec_instance_transform(uid, is_uid=True)['data'], 'evt.severity = 2\n')
+            self.transforms[uid] = 'drifted'
+            changes = api.sync_event_transforms({uid: 'evt.severity = 2\n'})
+            self.assertEqual([c['uid'] for c in changes], [uid])
+            self.assertEqual(api.get_ec_instance_transform(uid, is_uid=True)['data'], 'evt.severity = 2\n')
+        self.assertEqual(self.written, [uid])
+
+
+class TestTriggerRuleEngine(unittest.TestCase):
+    def setUp(self):
+        self.engine = TriggerRuleEngine([
+            {'name': 'critical', 'enabled': True,
+             'rule': {'source': '(dev.production_state == 1000) and (evt.severity >= 4)'}},
+            {'name': 'ping', 'enabled': True,
+             'rule': {'source': 'evt.event_class.startswith("/Status") and "Web" in dev.groups'}},
+            {'name': 'off', 'enabled': False, 'rule': {'source': 'True'}}])
+        self.device = {'uid': '/zport/dmd/Devices/Server/devices/web01', 'name': 'web01',
+                       'productionState': 1000, 'groups': [{'name': 'Web'}]}
+
+    def test_evaluate(self):
+        events = [{'severity': 5, 'device': {'text': 'web01'}, 'eventClass': {'text': '/Status/Ping'}},
+                  {'severity': 3, 'device': {'text': 'web01'}, 'eventClass': {'text': '/Perf'}},
+                  {'severity': 5, 'device': {'text': 'other'}, 'eventClass': {'text': '/Status/Ping'}}]
+        fired = [names for _, names in self.engine.evaluate(events, [self.device])]
+        self.assertEqual(fired, [['critical', 'ping'], [], []])
+
+    def test_context_device_class(self):
+        scope = TriggerRuleEngine.context({'severity': 2}, self.device)
+        self.assertEqual(scope['dev'].device_class, '/Server')
+        self.assertEqual(scope['evt'].severity, 2)
+        self.assertTrue(scope['evt'].summary is None)
+
+    def test_sandbox(self):
+        for source in ('__import__("os")', 'evt.__class__', 'evt.summary.format(1)', 'open("/etc/passwd")',
+                       '[x for x in evt]', 'lambda: 1'):
+            self.assertRaises(ZenossException, self.engine.compile, source)
+        self.assertTrue(self.engine.compile('evt.severity > 1') is self.engine.compile('evt.severity > 1'))
+
+
+class TestEventAggregator(unittest.TestCase):
+    def setUp(self):
+        self.aggregator = EventAggregator()
+        self.aggregator.add([
+            {'severity': 5, 'device': {'text': 'web01'}, 'eventClass': {'text': '/Status/Ping'},
+             'lastTime': 1000, 'count': 3},
+            {'severity': 4, 'device': {'text': 'web01'}, 'eventClass': {'text': '/Perf/CPU'},
+             'lastTime': 1290, 'count': 1},
+            {'severity': 5, 'device': {'text': 'db01'}, 'eventClass': {'text': '/Status/Ping'},
+             'lastTime': 1310, 'count': 1}])
+
+    def test_counts(self):
+        self.assertEqual(self.aggregator.counts_by('severity'), {5: 2, 4: 1})
+        self.assertEqual(self.aggregator.counts_by('device', weighted=True), {'web01': 4, 'db01': 1})
+        self.assertEqual(self.aggregator.top('device', 1), [('web01', 2)])
+        self.assertRaises(ZenossException, self.aggregator.counts_by, 'summary')
+
+    def test_histogram(self):
+        self.assertEqual(self.aggregator.histogram(300), {900: 1, 1200: 2})
+        self.assertEqual(self.aggregator.histogram(300, by='eventClass'),
+                         {900: {'/Status/Ping': 1}, 1200: {'/Perf/CPU': 1, '/Status/Ping': 1}})
+
+    def test_aggregate_events(self):
+        api = Zenoss('http://zenoss:8080', 'admin', 'password')
+        with HTTMock(response_content):
+            aggregator = api.aggregate_events(aggregator=self.aggregator, batch_size=1)
+        self.assertEqual(len(aggregator), 4)
+        self.assertEqual(aggregator.counts_by('severity'), {5: 2, 4: 1, 0: 1})
+
+
+class TestInventoryIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = InventoryIndex([
+            {'uid': '/zport/dmd/Devices/Server/Linux/devices/web01', 'name': 'web01', 'ipAddressString': '10.1.0.5',
+             'location': {'uid': '/zport/dmd/Locations/DC1/Row1'}, 'groups': [{'uid': '/zport/dmd/Groups/Web'}]},
+            {'uid': '/zport/dmd/Devices/Server/devices/web02', 'name': 'WEB02', 'ipAddressString': '10.2.0.5',
+             'location': None, 'groups': []},
+            {'uid': '/zport/dmd/Devices/Network/devices/sw01', 'name': 'sw01', 'ipAddressString': 'fe80::1',
+             'location': {'uid': '/zport/dmd/Locations/DC1'}, 'groups': [{'uid': '/zport/dmd/Groups/Web/Edge'}]}])
+
+    def names(self, devices):
+        return sorted(device['name'] for device in devices)
+
+    def test_queries(self):
+        self.assertEqual(self.names(self.index.by_prefix('web')), ['WEB02', 'web01'])
+        self.assertEqual(self.names(self.index.by_name('web02')), ['WEB02'])
+        self.assertEqual(self.names(self.index.by_regex(r'\d1$')), ['sw01', 'web01'])
+        self.assertEqual(self.names(self.index.by_cidr('10.1.0.0/16')), ['web01'])
+        self.assertEqual(self.names(self.index.by_cidr('fe80::/64')), ['sw01'])
+        self.assertEqual(self.names(self.index.by_ip('10.2.0.5')), ['WEB02'])
+        self.assertEqual(self.names(self.index.by_device_class('/Server')), ['WEB02', 'web01'])
+        self.assertEqual(self.names(self.index.by_device_class('/Server', subtree=False)), ['WEB02'])
+        self.assertEqual(self.names(self.index.by_location('/DC1')), ['sw01', 'web01'])
+        self.assertEqual(self.names(self.index.by_group('/Web', subtree=False)), ['web01'])
+
+    def test_remove(self):
+        self.index.remove('/zport/dmd/Devices/Server/Linux/devices/web01')
+        self.assertEqual(len(self.index), 2)
+        self.assertEqual(self.names(self.index.by_prefix('web')), ['WEB02'])
+        self.assertEqual(self.index.by_cidr('10.1.0.0/16'), [])
+        self.assertEqual(self.names(self.index.by_group('/Web')), ['sw01'])
+
+    def test_client_keeps_index_current(self):
+        api = Zenoss('http://zenoss:8080', 'admin', 'password')
+        with HTTMock(response_content):
+            index = api.build_inventory_index()
+            self.assertEqual(len(index), 1)
+            api.remove_device(TEST_SERVERNAME)
+            self.assertEqual(len(index), 0)
+            api.reset_ip(TEST_SERVERNAME)
+        self.assertEqual(self.names(index.by_prefix('test')), [TEST_SERVERNAME])
+
+
+class TestMetadataCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = MetadataCache(self.tmpdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_client_reads_are_cached_until_a_write(self):
+        calls = []
+
+        @urlmatch(path='.*router$')
+        def counting(url, request):
+            calls.append(json.loads(request.body)[0]['method'])
+            return {'status_code': 200, 'content': {'result': {'success': True, 'locations': []}}}
+
+        first = Zenoss('http://zenoss:8080', 'admin', 'password', metadata_cache=self.cache)
+        second = Zenoss('http://zenoss:8080', 'admin', 'password', metadata_cache=MetadataCache(self.tmpdir))
+        with HTTMock(counting):
+            first.get_locations()
+            self.assertTrue(second.get_locations()['success'])
+            second.get_devices()
+            second.add_location('Springfield')
+            first.get_locations()
+        self.assertEqual(calls, ['getLocations', 'getDevices', 'addLocationNode', 'getLocations'])
+
+    def test_crawls_pass_the_cache_by(self):
+        calls = []
+
+        @urlmatch(path='.*device_router$')
+        def counting(url, request):
+            calls.append(json.loads(request.body)[0]['method'])
+            return tree_content(url, request)
+
+        api = Zenoss('http://zenoss:8080', 'admin', 'password', metadata_cache=self.cache)
+        with HTTMock(counting):
+            api.crawl_organizer_tree()
+            api.crawl_organizer_tree()
+            api.get_organizer_tree(ttl=0)
+        self.assertEqual(calls, ['asyncGetTree'] * 12)
+
+    def test_ttl_and_eviction(self):
+        self.cache.ttls['groups'] = 0.05
+        self.cache.put('host', 'groups', ['a'], {'data': 1})
+        self.assertEqual(self.cache.get('host', 'groups', ['a']), (True, {'data': 1}))
+        time.sleep(0.1)
+        self.assertEqual(self.cache.get('host', 'groups', ['a']), (False, None))
+        self.cache.max_bytes = 0
+        self.cache.evict()
+        entries = [name for _, _, files in os.walk(self.tmpdir) for name in files if name.endswith('.json')]
+        self.assertEqual(entries, [])
+
+
+class TestRequestScheduler(unittest.TestCase):
+    def test_priority_order(self):
+        scheduler = RequestScheduler(max_in_flight=1)
+        scheduler.acquire('DeviceRouter', 'getDevices')
+        order = []
+
+        def request(priority):
+            scheduler.acquire('DeviceRouter', 'getDevices', priority)
+            order.append(priority)
+            scheduler.release()
+
+        threads = [threading.Thread(target=request, args=(p,)) for p in (PRIORITY_BULK, PRIORITY_INTERACTIVE)]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.05)
+        self.assertEqual(scheduler.stats()['queued'], 2)
+        scheduler.release()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, [PRIORITY_INTERACTIVE, PRIORITY_BULK])
+
+    def test_rate_limit(self):
+        scheduler = RequestScheduler(max_in_flight=10, limits={('DeviceRouter', 'remodel'): (20, 1)})
+        start = time.time()
+        for _ in range(3):
+            scheduler.acquire('DeviceRouter', 'remodel')
+            scheduler.release()
+        self.assertTrue(time.time() - start >= 0.09)
+
+    def test_client_uses_scheduler(self):
+        scheduler = RequestScheduler()
+        api = Zenoss('http://zenoss:8080', 'admin', 'password', scheduler=scheduler)
+        with HTTMock(response_content):
+            api.set_prod_state(TEST_SERVERNAME, 300)
+            with api.priority(PRIORITY_BULK):
+                api.get_devices()
+        stats = scheduler.stats()
+        self.assertEqual(stats['in_flight'], 0)
+        self.assertEqual(dict((p, s['requests']) for p, s in stats['priorities'].items()),
+                         {PRIORITY_READ: 1, PRIORITY_WRITE: 1, PRIORITY_BULK: 1})
+
+    def test_method_limit_does_not_block_other_requests(self):
+        scheduler = RequestScheduler(max_in_flight=4, limits={('DeviceRouter', 'remodel'): (2, 1)})
+        api = Zenoss('http://zenoss:8080', 'admin', 'password', scheduler=scheduler)
+
+        def remodel():
+            with api.priority(PRIORITY_BULK):
+                api.remodel_device('/zport/dmd/Devices/Server/devices/' + TEST_SERVERNAME)
+
+        with HTTMock(response_content):
+            threads = [threading.Thread(target=remodel) for _ in range(6)]
+            for thread in threads:
+                thread.start()
+            time.sleep(0.05)
+            start = time.time()
+            api.get_devices()
+            with api.priority(PRIORITY_BULK):
+                api.get_devices()
+            waited = time.time() - start
+            for thread in threads:
+                thread.join()
+        self.assertTrue(waited < 0.3, 'read waited %.2fs behind rate limited remodels' % waited)
+        self.assertEqual(scheduler.stats()['priorities'][PRIORITY_BULK]['requests'], 7)
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_concurrent_calls_share_one_request(self):
+        flight = SingleFlight()
+        calls = []
+
+        def slow():
+            calls.append(1)
+            time.sleep(0.1)
+            return 'result'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do('key', slow))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['result'] * 5)
+        self.assertEqual(flight.stats(), {'calls': 5, 'shared': 4, 'cached': 0})
+
+    def test_client_read_cache(self):
+        api = Zenoss('http://zenoss:8080', 'admin', 'password', read_cache_ttl=60)
+        calls = []
+
+        @urlmatch(path='.*router$')
+        def counting(url, request):
+            calls.append(json.loads(request.body)[0]['method'])
+            return response_content(url, request)
+
+        with HTTMock(counting):
+            first = api.get_devices()
+            first['devices'].append('mutated')
+            self.assertEqual(len(api.get_devices()['devices']), 1)
+            api.add_device('new.com', '/Server')
+            api.get_devices()
+        self.assertEqual(calls, ['getDevices', 'addDevice', 'getDevices'])
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def test_reads_are_retried(self):
+        policy = RetryPolicy(retries=3, backoff=0.01)
+        api = Zenoss('http://zenoss:8080', 'admin', 'password', retry_policy=policy)
+        failures = [{'status_code': 503, 'content': ''}, requests.ConnectionError('reset')]
+
+        @urlmatch(path='.*router$')
+        def flaky(url, request):
+            if failures:
+                failure = failures.pop(0)
+                if isinstance(failure, Exception):
+                    raise failure
+                return failure
+            return response_content(url, request)
+
+        with HTTMock(flaky):
+            self.assertTrue(api.get_devices()['success'])
+        self.assertEqual(policy.stats()['retries'], 2)
+
+    def test_writes_are_not_retried(self):
+        policy = RetryPolicy(retries=3, backoff=0.01)
+        api = Zenoss('http://zenoss:8080', 'admin', 'password', retry_policy=policy)
+        calls = []
+
+        @urlmatch(path='.*evconsole_router$')
+        def unavailable(url, request):
+            calls.append(1)
+            return {'status_code': 503, 'content': ''}
+
+        with HTTMock(unavailable):
+            self.assertRaises(ZenossException, api.write_log, 'evid', 'message')
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(policy.stats()['retries'], 0)
+
+    def test_deadline(self):
+        api = Zenoss('http://zenoss:8080', 'admin', 'password')
+        calls = []
+
+        @urlmatch(path='.*router$')
+        def counting(url, request):
+            calls.append(1)
+            return response_content(url, request)
+
+        with HTTMock(counting):
+            with api.deadline(60):
+                self.assertTrue(api.get_devices()['success'])
+                with api.deadline(0):
+                    self.assertRaises(ZenossException, api.get_devices)
+        self.assertEqual(len(calls), 1)
+
+    def test_slow_reads_are_hedged(self):
+        policy = RetryPolicy(hedge_after=0.05)
+        api = Zenoss('http://zenoss:8080', 'admin', 'password', retry_policy=policy)
+        calls = []
+
+        @urlmatch(path='.*router$')
+        def slow_first(url, request):
+            calls.append(1)
+            if len(calls) == 1:
+                time.sleep(0.5)
+            return response_content(url, request)
+
+        start = time.time()
+        with HTTMock(slow_first):
+            self.assertTrue(api.get_devices()['success'])
+            self.assertTrue(time.time() - start < 0.4)
+        stats = policy.stats()
+        self.assertEqual((stats['hedges'], stats['hedge_wins']), (1, 1))
+
+    def test_fast_reads_are_recorded(self):
+        policy = RetryPolicy(hedge_percentile=90)
+        api = Zenoss('http://zenoss:8080', 'admin', 'password', retry_policy=policy)
+        with HTTMock(response_content):
+            for _ in range(policy.min_samples + 30):
+                api.get_devices()
+        self.assertEqual(policy.stats()['requests'], policy.min_samples + 30)
+
+    def test_hedge_percentile(self):
+        policy = RetryPolicy(hedge_percentile=90)
+        self.assertEqual(policy.hedge_delay('getDevices'), None)
+        for millis in range(100):
+            policy.record('getDevices', millis / 1000.0)
+        self.assertEqual(policy.hedge_delay('getDevices'), 0.09)
+        self.assertEqual(policy.hedge_delay('query'), None)
+
+
+@urlmatch(path='.*evconsole_router$')
+def batch_content(url, request):
+    replies = []
+    for action in json.loads(request.body):
+        if action['method'] == 'write_log' and not action['data'][0]['message']:
+            replies.append({'tid': action['tid'], 'type': 'exception', 'message': 'Empty message'})
+        else:
+            replies.append({'tid': action['tid'], 'type': 'rpc', 'result': {'success': True}})
+    return {'status_code': 200, 'content': replies}
+
+
+class TestEventWriter(unittest.TestCase):
+    def setUp(self):
+        self.api = Zenoss('http://zenoss:8080', 'admin', 'password')
+
+    def test_batches_and_futures(self):
+        posts = []
+
+        @urlmatch(path='.*evconsole_router$')
+        def counting(url, request):
+            posts.append(len(json.loads(request.body)))
+            return batch_content(url, request)
+
+        with HTTMock(counting):
+            with self.api.event_writer(batch_size=3, flush_interval=60) as writer:
+                futures = [writer.create_event_on_device(TEST_SERVERNAME, 'Error', 'event %s' % i)
+                           for i in range(4)]
+                futures.append(writer.write_log('evid', ''))
+        self.assertEqual(posts, [3, 2])
+        self.assertTrue(all(f.result()['success'] for f in futures[:4]))
+        self.assertRaises(Exception, futures[4].result)
+        self.assertRaises(Exception, writer.write_log, 'evid', 'closed')
+
+    def test_flush_interval(self):
+        with HTTMock(batch_content):
+            writer = self.api.event_writer(flush_interval=0.05)
+            future = writer.write_log('evid', 'message')
+            self.assertTrue(future.result(timeout=5)['success'])
+            writer.close()
+
+
+class TestImport(unittest.TestCase):
+    HEAVY_MODULES = ('requests', 'urllib3', 'concurrent.futures', 'ast', 'mmap', 'difflib', 'hashlib')
+
+    def run_python(self, *args, **env):
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.dirname(os.path.dirname(__file__))] + sys.path),
+                   **env)
+        return subprocess.check_output([sys.executable] + list(args), env=env, stderr=subprocess.STDOUT)
+
+    def test_import_is_lazy(self):
+        loaded = self.run_python('-c', 'import sys, zenoss; zenoss.Zenoss("http://zenoss:8080", "admin", "pw"); '
+                                       'print(",".join(m for m in %r if m in sys.modules))' % (self.HEAVY_MODULES,))
+        self.assertEqual(loaded.decode('ascii').strip(), '')
+
+    @unittest.skipIf(sys.version_info < (3, 8), 'needs -X importtime and PYTHONPYCACHEPREFIX')
+    def test_import_time(self):
+        # Importing requests eagerly made zenoss cost more than requests itself. Bytecode goes to a
+        # private cache warmed by a first run, so compiling the module is not part of the measurement.
+        cache = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache)
+        env = dict(PYTHONPYCACHEPREFIX=cache, PYTHONDONTWRITEBYTECODE='')
+        self.run_python('-c', 'import zenoss, requests', **env)
+        output = self.run_python('-X', 'importtime', '-c', 'import zenoss, requests', **env).decode('utf-8')
+        cumulative = dict((line.split('|')[2].strip(), int(line.split('|')[1])) for line in output.splitlines()
+                          if line.startswith('import time:') and line.split('|')[1].strip().isdigit())
+        self.assertTrue(cumulative['zenoss'] < cumulative['requests'] / 2,
+                        'importing zenoss took %(zenoss)sus, requests %(requests)sus' % cumulative)
+
+
+class TestRouterClient(unittest.TestCase):
+    def test_router_attributes(self):
+        api = Zenoss('http://zenoss:8080', 'admin', 'password')
+        with HTTMock(response_content):
+            result = api.device_router.getDevices(uid='/zport/dmd/Devices', keys=['name'])
+            events = api.events_router.query(limit=10)
+        self.assertTrue(result['success'])
+        self.assertEqual(events['totalCount'], 1)
+        self.assertTrue(api.device_router is api.device_router)
+        self.assertRaises(AttributeError, getattr, api, 'no_such_router')
+
+    def test_router_components(self):
+        api = Zenoss('http://zenoss:8080', 'admin', 'password')
+        self.assertFalse('device_router' in vars(api))
+        with HTTMock(response_content):
+            self.assertEqual(api.get_devices()['devices'], api.device_router.get_devices()['devices'])
+            self.assertEqual(api.get_events(), api.events_router.get_events())
+        self.assertTrue(isinstance(api.device_router, DeviceRouterClient))
+        self.assertTrue(isinstance(api.events_router, EventsRouterClient))
+        self.assertEqual(type(api.messaging_router), RouterClient)
+        self.assertEqual(Zenoss.get_zproperty_values.__doc__, PropertiesRouterClient.get_zproperty_values.__doc__)
+        self.assertFalse('events_router' in vars(Zenoss('http://zenoss:8080', 'admin', 'password')))
+
+
+class TestInventorySnapshot(unittest.TestCase):
+    def setUp(self):
+        self.api = Zenoss('http://zenoss:8080', 'admin', 'password')
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_save_inventory_snapshot(self):
+        path = os.path.join(self.tmpdir, 'inventory.snap')
+        with HTTMock(response_content):
+            snapshot = self.api.save_inventory_snapshot(path)
+        devices = snapshot.table('devices')
+        self.assertEqual(len(devices), 1)
+        self.assertEqual(devices.column('name'), [TEST_SERVERNAME])
+        self.assertEqual(devices.find('123')['name'], TEST_SERVERNAME)
+        snapshot.close()
+
+    def test_snapshot_components_and_zproperties(self):
+        linux = '/zport/dmd/Devices/Server/Linux'
+        devices = [{'uid': linux + '/devices/web%02d' % i, 'name': 'web%02d' % i} for i in range(3)]
+        calls = []
+
+        @urlmatch(path='.*router$')
+        def inventory(url, request):
+            body = json.loads(request.body)[0]
+            calls.append(body['method'])
+            data = body['data'][0]
+            if body['method'] == 'getDevices':
+                result = {'success': True, 'hash': '1', 'totalCount': 3, 'devices': devices}
+            elif body['method'] == 'getComponents':
+                result = {'success': True, 'data': [{'uid': data['uid'] + '/os/eth0', 'name': 'eth0'}]}
+            elif body['method'] == 'getOverriddenObjectsList':
+                result = {'success': True, 'data': [{'uid': devices[2]['uid']}]}
+            else:
+                local = data['uid'] == devices[2]['uid']
+                result = {'success': True, 'data': [{'id': 'zSnmpCommunity', 'islocal': int(local), 'path': '/',
+                                                     'value': 'secret' if local else 'public'}]}
+            return {'status_code': 200, 'content': {'result': result}}
+
+        path = os.path.join(self.tmpdir, 'inventory.snap')
+        with HTTMock(inventory):
+            snapshot = self.api.save_inventory_snapshot(path, components=True, zproperties=True)
+        with snapshot:
+            self.assertEqual(snapshot.table('components').column('device'), [d['uid'] for d in devices])
+            self.assertEqual(list(snapshot.table('zproperties').records()),
+                             [{'uid': devices[2]['uid'], 'id': 'zSnmpCommunity', 'value': 'secret'}])
+        self.assertEqual(sorted(calls), ['getComponents'] * 3 + ['getDevices'] + ['getZenProperties'] * 3)
+
+    def test_snapshot_without_rows(self):
+        uid = '/zport/dmd/Devices/Server/Linux/devices/web01'
+
+        @urlmatch(path='.*router$')
+        def bare(url, request):
+            body = json.loads(request.body)[0]
+            if body['method'] == 'getDevices':
+                result = {'success': True, 'hash': '1', 'totalCount': 1, 'devices': [{'uid': uid, 'name': 'web01'}]}
+            else:
+                result = {'success': True, 'data': [{'id': 'zSnmpCommunity', 'islocal': 0, 'path': '/',
+                                                     'value': 'public'}]
+                          if body['method'] == 'getZenProperties' else []}
+            return {'status_code': 200, 'content': {'result': result}}
+
+        path = os.path.join(self.tmpdir, 'inventory.snap')
+        with HTTMock(bare):
+            snapshot = self.api.save_inventory_snapshot(path, components=True, zproperties=['zSnmpCommunity'])
+        with snapshot:
+            self.assertEqual(len(snapshot.table('components')), 0)
+            self.assertEqual(snapshot.table('zproperties').columns(), ['id', 'uid'])
+            self.assertEqual(snapshot.table('zproperties').find(uid, 'zSnmpCommunity'), None)
+        with HTTMock(bare):
+            snapshot = self.api.save_inventory_snapshot(path, zproperties=True)
+        with snapshot:
+            self.assertEqual(len(snapshot.table('zproperties')), 0)
+        write_snapshot(path, {'devices': (('uid',), [])})
+        with InventorySnapshot(path) as empty:
+            self.assertEqual(list(empty.table('devices').records()), [])
+
+    def test_diff_snapshots(self):
+        old = [{'uuid': 'a', 'uid': '/zport/dmd/Devices/Server/devices/web01', 'name': 'web01'},
+               {'uuid': 'b', 'uid': '/zport/dmd/Devices/Server/devices/db01', 'name': 'db01'},
+               {'uuid': 'c', 'uid': '/zport/dmd/Devices/Server/devices/old01', 'name': 'old01'}]
+        new = [{'uuid': 'a', 'uid': '/zport/dmd/Devices/Server/Linux/devices/web01', 'name': 'web01'},
+               {'uuid': 'b', 'uid': '/zport/dmd/Devices/Server/devices/db02', 'name': 'db02'},
+               {'uuid': 'd', 'uid': '/zport/dmd/Devices/Server/devices/new01', 'name': 'new01'}]
+        write_snapshot(os.path.join(self.tmpdir, 'old.snap'), {'devices': (('uuid',), old)})
+        write_snapshot(os.path.join(self.tmpdir, 'new.snap'), {'devices': (('uuid',), new)})
+        with InventorySnapshot(os.path.join(self.tmpdir, 'old.snap')) as before:
+            with InventorySnapshot(os.path.join(self.tmpdir, 'new.snap')) as after:
+                diff = diff_snapshots(before, after)
+        self.assertEqual([d['name'] for d in diff['added']], ['new01'])
+        self.assertEqual([d['name'] for d in diff['removed']], ['old01'])
+        self.assertEqual(diff['moved'], [{'name': 'web01', 'from': '/zport/dmd/Devices/Server',
+                                          'to': '/zport/dmd/Devices/Server/Linux'}])
+        self.assertEqual(diff['renamed'], [{'uid': '/zport/dmd/Devices/Server/devices/db02',
+                                            'from': 'db01', 'to': 'db02'}])
+
 
 if __name__ == '__main__':
     unittest.main()
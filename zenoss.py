@@ -1,13 +1,28 @@
 '''Python module to work with the Zenoss JSON API
 '''
-import ast
+import atexit
+import codecs
+import itertools
 import re
 import json
 import logging
-import requests
+import os
+import random
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter, deque
+from contextlib import contextmanager
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# requests, concurrent.futures and the other heavier modules are imported where
+# they are first used, so importing this module stays cheap for short lived scripts.
 
 log = logging.getLogger(__name__) # pylint: disable=C0103
-requests.packages.urllib3.disable_warnings()
 
 ROUTERS = {'MessagingRouter': 'messaging',
            'EventsRouter': 'evconsole',
@@ -25,6 +40,55 @@ ROUTERS = {'MessagingRouter': 'messaging',
            'TriggersRouter': 'triggers',
            'ZenPackRouter': 'zenpack'}
 
+# Attribute names that give a RouterClient for each router, such as device_router
+ROUTER_ATTRIBUTES = dict((re.sub('([a-z])([A-Z])', r'\1_\2', router).lower(), router) for router in ROUTERS)
+
+# Device attributes stored in an inventory snapshot unless told otherwise
+SNAPSHOT_DEVICE_COLUMNS = ('uuid', 'uid', 'name', 'ipAddressString', 'productionState', 'collector',
+                           'deviceClass', 'location', 'groups', 'systems', 'priority')
+SNAPSHOT_MAGIC = b'ZSNAP1\n'
+
+# Device attributes fetched when the library only needs to address a device
+DEVICE_LOOKUP_KEYS = ('uid', 'name')
+
+# Router methods that only read state and are safe to repeat
+READ_METHODS = frozenset(['getDevices', 'getComponents', 'getInfo', 'getLocations', 'getGroups', 'asyncGetTree',
+                          'getTemplates', 'getInstances', 'getInstanceData', 'getTransform', 'getZenProperties',
+                          'getNotifications', 'getTriggers', 'query', 'detail',
+                          'getOverriddenObjectsList'])
+
+EVENT_SEVERITIES = ('Critical', 'Error', 'Warning', 'Info', 'Debug', 'Clear')
+
+# Device attributes kept in an InventoryIndex
+INDEX_KEYS = ('uid', 'name', 'ipAddressString', 'location', 'groups', 'systems')
+
+# Event fields pulled in by aggregate_events
+AGGREGATE_KEYS = ('severity', 'device', 'eventClass', 'component', 'lastTime', 'count')
+
+# Python syntax allowed in trigger rules evaluated by TriggerRuleEngine
+TRIGGER_RULE_NODES = frozenset(['Expression', 'BoolOp', 'And', 'Or', 'UnaryOp', 'Not', 'USub', 'Compare',
+                                'Eq', 'NotEq', 'Lt', 'LtE', 'Gt', 'GtE', 'In', 'NotIn', 'Is', 'IsNot',
+                                'Name', 'Load', 'Attribute', 'Call', 'Tuple', 'List', 'Set',
+                                'Constant', 'Str', 'Num', 'NameConstant', 'Bytes'])
+TRIGGER_RULE_NAMES = frozenset(['evt', 'dev', 'elem', 'sub_elem', 'True', 'False', 'None'])
+TRIGGER_RULE_CALLS = frozenset(['startswith', 'endswith', 'lower', 'upper', 'strip'])
+
+# Seconds the results of slow changing configuration stay in a MetadataCache
+METADATA_TTLS = {'device_classes': 3600,
+                 'templates': 3600,
+                 'event_classes': 3600,
+                 'locations': 3600,
+                 'groups': 3600}
+
+# HTTP statuses after which a RetryPolicy retries a read
+RETRY_STATUSES = frozenset([502, 503, 504])
+
+# Request priorities, lower numbers are sent first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_WRITE = 1
+PRIORITY_READ = 2
+PRIORITY_BULK = 3
+
 
 class ZenossException(Exception):
     '''Custom exception for Zenoss
@@ -32,18 +96,38 @@ class ZenossException(Exception):
     pass
 
 
+class DeviceNotFound(ZenossException):
+    '''Raised when no device has the name that was looked up
+    '''
+    pass
+
+
 class Zenoss(object):
     '''A class that represents a connection to a Zenoss server
+
+    The methods for devices, events, event classes, triggers and zProperties live
+    on router clients such as device_router, created on first use. This class
+    hands calls of those methods on to them.
     '''
-    def __init__(self, host, username, password, ssl_verify=True):
+    def __init__(self, host, username, password, ssl_verify=True, scheduler=None, # pylint: disable=R0913
+                 coalesce_reads=False, read_cache_ttl=0, metadata_cache=None, retry_policy=None):
         self.__host = host
-        self.__session = requests.Session()
-        self.__session.auth = (username, password)
-        self.__session.verify = ssl_verify
-        self.__req_count = 0
-
-    def __router_request(self, router, method, data=None, uri=None):
-        '''Internal method to make calls to the Zenoss request router
+        self.__scheduler = scheduler
+        self.__retry_policy = retry_policy
+        self.__metadata_cache = metadata_cache
+        self.__single_flight = SingleFlight(read_cache_ttl) if coalesce_reads or read_cache_ttl else None
+        self.__local = threading.local()
+        self.__session = None
+        self.__session_lock = threading.Lock()
+        self.__auth = (username, password)
+        self.__ssl_verify = ssl_verify
+        self.__req_count = itertools.count()
+        self.__trees = dict()
+        self.__clients_lock = threading.Lock()
+
+    def __router_request(self, router, method, data=None, uri=None, cached=True): # pylint: disable=R0913
+        '''Internal method to make calls to the Zenoss request router.
+            With cached=False reads skip the metadata cache, writes still invalidate it.
         '''
         if router not in ROUTERS:
             raise ZenossException('Router "' + router + '" not available.')
@@ -53,14 +137,81 @@ class Zenoss(object):
             method=method,
             data=data,
             type='rpc',
-            tid=self.__req_count)])
+            tid=next(self.__req_count))])
         log.debug('Making request to router %s with method %s', router, method)
         if not uri:
             uri = '%s/zport/dmd/%s_router' % (self.__host, ROUTERS[router])
-        headers = {'Content-type': 'application/json; charset=utf-8'}
-        response = self.__session.post(uri, data=req_data, headers=headers)
-        self.__req_count += 1
+        category = metadata_category(router, method, data) if self.__metadata_cache is not None else None
+        if category is None:
+            return self.__send(router, method, data, uri, req_data)
+        if method not in READ_METHODS:
+            result = self.__send(router, method, data, uri, req_data)
+            self.__metadata_cache.invalidate(self.__host, category)
+            return result
+        if not cached:
+            return self.__send(router, method, data, uri, req_data)
+        key = [uri, router, method, data]
+        found, result = self.__metadata_cache.get(self.__host, category, key)
+        if not found:
+            fetched = time.time()
+            result = self.__send(router, method, data, uri, req_data)
+            self.__metadata_cache.put(self.__host, category, key, result, fetched)
+        return result
+
+    def __send(self, router, method, data, uri, req_data):
+        '''Post a prepared router request and return its result
+        '''
+        if self.__single_flight is None:
+            response = self.__post(router, method, uri, req_data)
+        elif method in READ_METHODS:
+            # Identical concurrent reads share one request, the tid is left out of the key
+            key = (uri, router, method, json.dumps(data, sort_keys=True))
+            response = self.__single_flight.do(key, lambda: self.__post(router, method, uri, req_data),
+                                               cacheable=lambda resp: resp.status_code == 200)
+        else:
+            response = self.__post(router, method, uri, req_data)
+            self.__single_flight.forget()
+        return self.__decode(response, req_data)['result']
 
+    def __router_batch(self, router, calls):
+        '''Internal method to send several (method, data) calls to one router in a single request.
+            Returns the result of every call in order, or the exception a call raised on the server.
+        '''
+        if router not in ROUTERS:
+            raise ZenossException('Router "' + router + '" not available.')
+        actions = [dict(action=router, method=method, data=data, type='rpc', tid=next(self.__req_count))
+                   for method, data in calls]
+        req_data = json.dumps(actions)
+        log.debug('Making batch request to router %s with %s calls', router, len(actions))
+        uri = '%s/zport/dmd/%s_router' % (self.__host, ROUTERS[router])
+        response = self.__post(router, actions[0]['method'], uri, req_data,
+                               idempotent=all(method in READ_METHODS for method, _ in calls))
+        if self.__single_flight is not None:
+            self.__single_flight.forget()
+        if self.__metadata_cache is not None:
+            categories = set(metadata_category(router, method, data) for method, data in calls
+                             if method not in READ_METHODS)
+            for category in categories.difference([None]):
+                self.__metadata_cache.invalidate(self.__host, category)
+        replies = self.__decode(response, req_data)
+        if isinstance(replies, dict):
+            replies = [replies]
+        replies = dict((reply.get('tid'), reply) for reply in replies)
+        results = list()
+        for action in actions:
+            reply = replies.get(action['tid'])
+            if reply is None:
+                results.append(ZenossException('No reply for %s call' % action['method']))
+            elif reply.get('type') == 'exception':
+                results.append(ZenossException(reply.get('message', 'Router exception')))
+            else:
+                results.append(reply.get('result'))
+        return results
+
+    @staticmethod
+    def __decode(response, req_data):
+        '''Check a router response and return its decoded body
+        '''
         # The API returns a 200 response code even whe auth is bad.
         # With bad auth, the login page is displayed. Here I search for
         # an element on the login form to determine if auth failed.
@@ -68,13 +219,211 @@ class Zenoss(object):
             log.error('Request failed. Bad username/password.')
             raise ZenossException('Request failed. Bad username/password.')
         if response.status_code == 200:
-            return json.loads(response.content.decode("utf-8"))['result']
+            return json.loads(response.content.decode("utf-8"))
         else:
             raise ZenossException("Unable to complete request:\n%s\nHTTP Status: %s" % (
                 req_data,
                 response.status_code,
             ))
 
+    def __router_stream(self, router, method, data, key, chunk_size=65536):
+        '''Internal method to make a router call and yield the elements of the key array of its result
+            while the response is still being read.
+        '''
+        req_data = json.dumps([dict(action=router, method=method, data=data, type='rpc',
+                                    tid=next(self.__req_count))])
+        log.debug('Making streaming request to router %s with method %s', router, method)
+        uri = '%s/zport/dmd/%s_router' % (self.__host, ROUTERS[router])
+        response = self.__post(router, method, uri, req_data, stream=True)
+        try:
+            if response.status_code != 200:
+                raise ZenossException("Unable to complete request:\n%s\nHTTP Status: %s" % (
+                    req_data,
+                    response.status_code,
+                ))
+            for element in iter_json_array(response.iter_content(chunk_size), key):
+                yield element
+        finally:
+            response.close()
+
+    def __http(self):
+        '''Return the HTTP session, creating it on first use
+        '''
+        if self.__session is None:
+            with self.__session_lock:
+                if self.__session is None:
+                    import requests
+                    requests.packages.urllib3.disable_warnings()
+                    session = requests.Session()
+                    session.auth = self.__auth
+                    session.verify = self.__ssl_verify
+                    self.__session = session
+        return self.__session
+
+    def __getattr__(self, name):
+        '''Create the RouterClient for attributes such as device_router on first access
+        '''
+        if name not in ROUTER_ATTRIBUTES:
+            raise AttributeError(name)
+        with self.__clients_lock:
+            if name not in self.__dict__:
+                router = ROUTER_ATTRIBUTES[name]
+                self.__dict__[name] = ROUTER_CLIENTS.get(router, RouterClient)(
+                    self, router, self.__host, self.__router_request, self.__router_batch, self.__router_stream,
+                    self.__concurrently, self.__organizer_changed)
+        return self.__dict__[name]
+
+    def __post(self, router, method, uri, req_data, stream=False, idempotent=None): # pylint: disable=R0913
+        '''Send a request to the router, retrying and hedging reads when there is a retry policy
+        '''
+        if idempotent is None:
+            idempotent = method in READ_METHODS
+        priority = getattr(self.__local, 'priority', None)
+        if priority is None:
+            priority = PRIORITY_READ if idempotent else PRIORITY_WRITE
+        deadline = getattr(self.__local, 'deadline', None)
+        policy = self.__retry_policy
+        if policy is None or stream or not idempotent:
+            return self.__post_once(router, method, uri, req_data, priority, deadline, stream)
+        import requests
+        attempt = 0
+        while True:
+            error = None
+            try:
+                response = self.__post_hedged(router, method, uri, req_data, priority, deadline)
+            except (requests.ConnectionError, requests.Timeout) as ex:
+                response, error = None, ex
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+            delay = policy.backoff_delay(attempt)
+            if attempt >= policy.retries or (deadline is not None and time.time() + delay >= deadline):
+                if error is not None:
+                    raise error
+                return response
+            if response is not None:
+                response.close()
+            log.warning('Retrying %s.%s in %.2fs after %s', router, method, delay,
+                        error or 'HTTP status %s' % response.status_code)
+            policy.count('retries')
+            time.sleep(delay)
+            attempt += 1
+
+    def __post_hedged(self, router, method, uri, req_data, priority, deadline): # pylint: disable=R0913
+        '''Send a read, sending it again if it is slower than the hedge delay of the retry policy
+        '''
+        policy = self.__retry_policy
+        delay = policy.hedge_delay(method)
+        started = time.time()
+        if delay is None:
+            response = self.__post_once(router, method, uri, req_data, priority, deadline)
+            policy.record(method, time.time() - started)
+            return response
+        from concurrent.futures import wait, FIRST_COMPLETED
+        send = lambda: self.__post_once(router, method, uri, req_data, priority, deadline)
+        first = policy.submit(send)
+        pending = wait([first], delay).not_done
+        if not pending:
+            response = first.result()
+            policy.record(method, time.time() - started)
+            return response
+        policy.count('hedges')
+        pending.add(policy.submit(send))
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winners = [future for future in done if future.exception() is None]
+            if not winners:
+                error = done.pop().exception()
+                continue
+            for future in winners[1:]:
+                future.result().close()
+            for future in pending:
+                future.add_done_callback(_close_response)
+            if winners[0] is not first:
+                policy.count('hedge_wins')
+            policy.record(method, time.time() - started)
+            return winners[0].result()
+        raise error
+
+    def __post_once(self, router, method, uri, req_data, priority, deadline, stream=False): # pylint: disable=R0913
+        '''Send a request once, waiting for the scheduler when there is one
+        '''
+        headers = {'Content-type': 'application/json; charset=utf-8'}
+        if self.__scheduler is not None:
+            self.__scheduler.acquire(router, method, priority)
+        try:
+            timeout = self.__retry_policy.timeout if self.__retry_policy is not None else None
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    if self.__retry_policy is not None:
+                        self.__retry_policy.count('deadline_exceeded')
+                    raise ZenossException('Deadline exceeded before calling %s.%s' % (router, method))
+                timeout = remaining if timeout is None else min(timeout, remaining)
+            return self.__http().post(uri, data=req_data, headers=headers, stream=stream, timeout=timeout)
+        finally:
+            if self.__scheduler is not None:
+                self.__scheduler.release()
+
+    def __concurrently(self, func, items, workers):
+        '''Run func over items with _run_concurrently, keeping this thread's priority, PRIORITY_BULK
+            when none was set, and its deadline
+        '''
+        priority = getattr(self.__local, 'priority', None)
+        state = (PRIORITY_BULK if priority is None else priority, getattr(self.__local, 'deadline', None))
+
+        def bound(item):
+            '''Call func with the state of the calling thread'''
+            previous = (getattr(self.__local, 'priority', None), getattr(self.__local, 'deadline', None))
+            self.__local.priority, self.__local.deadline = state
+            try:
+                return func(item)
+            finally:
+                self.__local.priority, self.__local.deadline = previous
+        return _run_concurrently(bound, items, workers)
+
+    @contextmanager
+    def priority(self, priority):
+        '''
+        send the router requests made by this thread inside the block with the given priority
+
+        Only has an effect when the client was created with a RequestScheduler.
+
+        usage::
+            >>> with zen.priority(PRIORITY_BULK):
+            ...     for name in names:
+            ...         zen.remodel_device(name)
+        '''
+        previous = getattr(self.__local, 'priority', None)
+        self.__local.priority = priority
+        try:
+            yield
+        finally:
+            self.__local.priority = previous
+
+    @contextmanager
+    def deadline(self, seconds):
+        '''
+        give up on the router requests made inside the block once seconds have passed
+
+        The deadline covers every request of compound calls such as reconcile_devices,
+        including the ones they make on worker threads. A nested block can only make
+        the deadline sooner. Requests started after the deadline raise ZenossException,
+        running ones are sent with a timeout of the time left.
+
+        usage::
+            >>> with zen.deadline(30):
+            ...     zen.reconcile_devices(desired)
+        '''
+        previous = getattr(self.__local, 'deadline', None)
+        deadline = time.time() + seconds
+        self.__local.deadline = deadline if previous is None else min(previous, deadline)
+        try:
+            yield
+        finally:
+            self.__local.deadline = previous
+
     def get_rrd_values(self, device, dsnames, start=None, end=None, function='LAST'): # pylint: disable=R0913
         '''Method to abstract the details of making a request to the getRRDValue method for a device
         '''
@@ -87,15 +436,777 @@ class Zenoss(object):
 
         url = '{0}/{1}/getRRDValues'.format(self.__host, self.device_uid(device))
         params = {'dsnames': dsnames, 'start': start, 'end': end, 'function': function}
-        return ast.literal_eval(self.__session.get(url, params=params).content)
+        import ast
+        return ast.literal_eval(self.__http().get(url, params=params).content)
+
+    def get_load_average(self, device):
+        '''Returns the current 1, 5 and 15 minute load averages for a device.
+        '''
+        dsnames = ('laLoadInt1_laLoadInt1', 'laLoadInt5_laLoadInt5', 'laLoadInt15_laLoadInt15')
+        result = self.get_rrd_values(device=device, dsnames=dsnames)
+        def normalize_load(load):
+            '''Convert raw RRD load average to something reasonable so that it matches output from /proc/loadavg'''
+            return round(float(load) / 100.0, 2)
+        return [normalize_load(l) for l in result.values()]
+
+    def add_hardware_product(self, product_name, manufacturer, product_type, part_number="",
+                             product_keys="", description=""):
+        '''
+        Add Hardware
+        '''
+        log.info('Adding Hardware Product %s', product_name)
+        tmp = dict(prodname=product_name, uid="/zport/dmd/Manufacturers/%s" % manufacturer,
+                   type=product_type, description=description, partno=part_number,
+                   prodkeys=product_keys)
+        data = dict(params=tmp)
+        return self.__router_request('ManufacturersRouter', 'addNewProduct', [data])
+
+    def crawl_organizer_tree(self, root='/zport/dmd/Devices', workers=8):
+        '''
+        crawl a whole organizer hierarchy breadth first
+
+        Every level of the tree is requested concurrently, so the number of round
+        trips grows with the depth of the tree rather than its size.
+
+        :param root: uid of the organizer to start from, such as /zport/dmd/Locations
+        :type root: string
+        :param workers: number of requests to run at once
+        :type workers: int
+        :return: the crawled tree
+        :rtype: OrganizerTree
+
+        usage::
+            >>> tree = zen.crawl_organizer_tree('/zport/dmd/Devices')
+            >>> tree.find('/Network/Router')['uid']
+            u'/zport/dmd/Devices/Network/Router'
+        '''
+        tree = OrganizerTree(root.rstrip('/'))
+        self.__crawl(tree, tree.root, workers)
+        return tree
+
+    def get_organizer_tree(self, root='/zport/dmd/Devices', ttl=300, workers=8):
+        '''
+        return a cached organizer tree, crawling it when missing or older than ttl seconds
+
+        Organizers added or removed through this client only cause the affected
+        subtree to be crawled again on the next call.
+
+        :param root: uid of the organizer hierarchy
+        :type root: string
+        :param ttl: seconds a crawled tree stays valid
+        :type ttl: int
+        :return: the organizer tree
+        :rtype: OrganizerTree
+        '''
+        root = root.rstrip('/')
+        cached = self.__trees.get(root)
+        if cached is None or time.time() - cached.crawled > ttl:
+            cached = self.__trees[root] = self.crawl_organizer_tree(root, workers=workers)
+        while cached.dirty:
+            uid = cached.dirty.pop()
+            if uid in cached:
+                log.info('Refreshing organizer subtree %s', uid)
+                self.__crawl(cached, uid, workers)
+        return cached
+
+    def __crawl(self, tree, uid, workers):
+        '''Crawl the subtree below uid into tree, one concurrent batch per level.
+            The tree keeps its own ttl, so the metadata cache is passed by.
+        '''
+        router = 'EventClassesRouter' if tree.root.startswith('/zport/dmd/Events') else 'DeviceRouter'
+        frontier = [uid]
+        while frontier:
+            levels = self.__concurrently(
+                lambda node: self.__router_request(router, 'asyncGetTree', [node], cached=False), frontier, workers)
+            next_frontier = list()
+            for parent, children in zip(frontier, levels):
+                tree.set_children(parent, children or [])
+                next_frontier.extend(child['uid'] for child in children or [] if not child.get('leaf'))
+            frontier = next_frontier
+        tree.crawled = time.time()
+
+    def __organizer_changed(self, uid):
+        '''Mark the cached subtree holding organizer uid for a refresh'''
+        uid = uid.rstrip('/')
+        for root, tree in self.__trees.items():
+            if uid == root or uid.startswith(root + '/'):
+                tree.dirty.add(uid)
+
+
+def _snapshot_cell(value):
+    '''Encode a single snapshot cell, JSON keeps every cell on one line'''
+    return json.dumps(value, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def write_snapshot(path, tables):
+    '''
+    write tables of records to a columnar snapshot file
+
+    Every column is stored as one block of newline separated JSON cells and the
+    rows of every table are sorted by their key columns, so snapshots can be
+    compared with a single merge pass.
+
+    :param path: file to write the snapshot to
+    :type path: string
+    :param tables: table name mapped to a (key columns, list of dicts) tuple
+    :type tables: dict
+    '''
+    header = dict(tables=dict())
+    blocks = list()
+    offset = 0
+    for name, (key, records) in sorted(tables.items()):
+        # A table without records still gets its key columns
+        columns = sorted(set(column for record in records for column in record) or key)
+        for column in key:
+            if column not in columns:
+                raise ZenossException('Key column %s missing from snapshot table %s' % (column, name))
+        rows = [[_snapshot_cell(record.get(column)) for column in columns] for record in records]
+        rows.sort(key=lambda row, idx=[columns.index(column) for column in key]: [row[i] for i in idx])
+        layout = dict()
+        for i, column in enumerate(columns):
+            block = b'\n'.join(row[i] for row in rows)
+            layout[column] = [offset, len(block)]
+            blocks.append(block)
+            offset += len(block)
+        header['tables'][name] = dict(key=list(key), rows=len(rows), columns=layout)
+    with open(path, 'wb') as snapshot:
+        snapshot.write(SNAPSHOT_MAGIC)
+        snapshot.write(json.dumps(header).encode('utf-8') + b'\n')
+        for block in blocks:
+            snapshot.write(block)
+
+
+class InventorySnapshot(object):
+    '''A read only, memory mapped inventory snapshot written by write_snapshot
+    '''
+    def __init__(self, path):
+        import mmap
+        self.path = path
+        with open(path, 'rb') as snapshot:
+            if snapshot.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                raise ZenossException('%s is not an inventory snapshot' % path)
+            header = snapshot.readline()
+            self.__base = len(SNAPSHOT_MAGIC) + len(header)
+            self.__tables = json.loads(header.decode('utf-8'))['tables']
+            if os.path.getsize(path) > self.__base:
+                self.__map = mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.__map = b''
+
+    def tables(self):
+        '''Names of the tables held in the snapshot'''
+        return sorted(self.__tables)
+
+    def table(self, name):
+        '''Return a table of the snapshot'''
+        if name not in self.__tables:
+            raise ZenossException('Snapshot %s has no table %s' % (self.path, name))
+        return SnapshotTable(self.__map, self.__base, self.__tables[name])
+
+    def close(self):
+        '''Release the memory map'''
+        if not isinstance(self.__map, bytes):
+            self.__map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class SnapshotTable(object):
+    '''A single table of an InventorySnapshot, columns are only read when used
+    '''
+    def __init__(self, data, base, layout):
+        self.__data = data
+        self.__base = base
+        self.__layout = layout
+        self.__raw = dict()
+        self.key = tuple(layout['key'])
+
+    def __len__(self):
+        return self.__layout['rows']
+
+    def columns(self):
+        '''Names of the columns in the table'''
+        return sorted(self.__layout['columns'])
+
+    def raw_column(self, column):
+        '''Return the still encoded cells of a column'''
+        if column not in self.__raw:
+            if column not in self.__layout['columns']:
+                raise ZenossException('Snapshot table has no column %s' % column)
+            offset, length = self.__layout['columns'][column]
+            start = self.__base + offset
+            cells = self.__data[start:start + length].split(b'\n') if len(self) else []
+            self.__raw[column] = cells
+        return self.__raw[column]
+
+    def column(self, column):
+        '''Return the decoded values of a column'''
+        return [json.loads(cell.decode('utf-8')) for cell in self.raw_column(column)]
+
+    def value(self, column, row):
+        '''Return a single decoded cell'''
+        return json.loads(self.raw_column(column)[row].decode('utf-8'))
+
+    def record(self, row):
+        '''Rebuild the dict for a row'''
+        return dict((column, self.value(column, row)) for column in self.columns())
+
+    def records(self):
+        '''Iterate over all rows as dicts'''
+        for row in range(len(self)):
+            yield self.record(row)
+
+    def raw_keys(self):
+        '''Return the encoded key of every row, in sorted order'''
+        columns = [self.raw_column(column) for column in self.key]
+        return [list(cells) for cells in zip(*columns)]
+
+    def find(self, *key):
+        '''Return the row holding the given key, or None'''
+        keys = self.raw_keys()
+        wanted = [_snapshot_cell(value) for value in key]
+        row = bisect_left(keys, wanted)
+        if row < len(keys) and keys[row] == wanted:
+            return self.record(row)
+        return None
+
+
+def _uid_organizer(uid):
+    '''Return the organizer part of a device uid'''
+    return uid.rsplit('/devices/', 1)[0] if uid else uid
+
+
+def diff_snapshots(old, new, table='devices'):
+    '''
+    compare the devices of two snapshots
+
+    The rows of both snapshots are sorted by key, so this walks both key columns
+    once and only decodes the cells of rows that differ. Devices are matched on
+    uuid when the snapshots carry it; otherwise a device that disappeared under
+    one uid and showed up under another with the same name is reported as moved.
+
+    :param old: older snapshot
+    :type old: InventorySnapshot
+    :param new: newer snapshot
+    :type new: InventorySnapshot
+    :return: dict with added, removed, moved and renamed lists
+    :rtype: dict
+
+    usage::
+        >>> diff_snapshots(InventorySnapshot('1100.snap'), InventorySnapshot('1200.snap'))
+        {'added': [{'uid': ..., 'name': ...}], 'removed': [], 'moved': [
+            {'name': u'web01', 'from': u'/zport/dmd/Devices/Server', 'to': u'/zport/dmd/Devices/Server/Linux'}],
+         'renamed': []}
+    '''
+    old_table, new_table = old.table(table), new.table(table)
+    if old_table.key != new_table.key:
+        raise ZenossException('Snapshots are keyed on different columns')
+    old_keys, new_keys = old_table.raw_keys(), new_table.raw_keys()
+    old_uids, new_uids = old_table.raw_column('uid'), new_table.raw_column('uid')
+    old_names, new_names = old_table.raw_column('name'), new_table.raw_column('name')
+    result = dict(added=[], removed=[], moved=[], renamed=[])
+    removed, added = list(), list()
+    i = j = 0
+    while i < len(old_keys) or j < len(new_keys):
+        if j >= len(new_keys) or (i < len(old_keys) and old_keys[i] < new_keys[j]):
+            removed.append(i)
+            i += 1
+        elif i >= len(old_keys) or new_keys[j] < old_keys[i]:
+            added.append(j)
+            j += 1
+        else:
+            if old_names[i] != new_names[j]:
+                result['renamed'].append({'uid': new_table.value('uid', j),
+                                          'from': old_table.value('name', i),
+                                          'to': new_table.value('name', j)})
+            if old_uids[i] != new_uids[j]:
+                before = _uid_organizer(old_table.value('uid', i))
+                after = _uid_organizer(new_table.value('uid', j))
+                if before != after:
+                    result['moved'].append({'name': new_table.value('name', j), 'from': before, 'to': after})
+            i += 1
+            j += 1
+    added_names = dict((new_names[j], j) for j in added)
+    for i in removed:
+        j = added_names.pop(old_names[i], None)
+        if j is None:
+            result['removed'].append({'uid': old_table.value('uid', i), 'name': old_table.value('name', i)})
+        else:
+            result['moved'].append({'name': new_table.value('name', j),
+                                    'from': _uid_organizer(old_table.value('uid', i)),
+                                    'to': _uid_organizer(new_table.value('uid', j))})
+    for j in sorted(added_names.values()):
+        result['added'].append({'uid': new_table.value('uid', j), 'name': new_table.value('name', j)})
+    return result
+
+
+def iter_json_array(chunks, key):
+    '''
+    incrementally parse a JSON document and yield the elements of the array stored under key
+
+    chunks is an iterable of bytes such as response.iter_content(). Parsing starts at
+    the first "key": [ found outside of a string and only one element is held in
+    memory at a time.
+    '''
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    marker = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+    buf = ''
+    started = False
+    for chunk in itertools.chain(chunks, [None]):
+        last = chunk is None
+        buf += utf8.decode(b'', True) if last else utf8.decode(chunk)
+        if not started:
+            # The API returns the login page instead of an error when auth is bad
+            if 'name="__ac_name"' in buf:
+                log.error('Request failed. Bad username/password.')
+                raise ZenossException('Request failed. Bad username/password.')
+            match = marker.search(buf)
+            if match is None:
+                if last:
+                    raise ZenossException('Response holds no %s array' % key)
+                # Keep enough of the tail for a marker split over two chunks
+                buf = buf[-(len(key) + 256):]
+                continue
+            buf = buf[match.end():]
+            started = True
+        while True:
+            buf = buf.lstrip(' \t\r\n,')
+            if not buf:
+                break
+            if buf[0] == ']':
+                return
+            try:
+                value, end = decoder.raw_decode(buf)
+            except ValueError:
+                if last:
+                    raise ZenossException('Response ended inside the %s array' % key)
+                break
+            if end == len(buf) and not last:
+                # A number at the very end of the buffer may continue in the next chunk
+                break
+            yield value
+            buf = buf[end:]
+    raise ZenossException('Response ended inside the %s array' % key)
+
+
+def _transform_hash(source):
+    '''Hash a transform, ignoring trailing whitespace and line ending style'''
+    import hashlib
+    lines = [line.rstrip() for line in (source or '').replace('\r\n', '\n').split('\n')]
+    return hashlib.sha1('\n'.join(lines).strip('\n').encode('utf-8')).hexdigest()
+
+
+def _run_concurrently(func, items, workers=8):
+    '''Call func for every item on a thread pool, results are returned in order'''
+    items = list(items)
+    if len(items) < 2 or workers < 2:
+        return [func(item) for item in items]
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=min(workers, len(items))) as pool:
+        return list(pool.map(func, items))
+
+
+def _close_response(future):
+    '''Close the response of a finished request nobody is waiting for'''
+    if future.exception() is None:
+        future.result().close()
+
+
+def _device_name(device):
+    '''Name of a device given as a name, uid, Device handle or device dict, without a lookup'''
+    if isinstance(device, (Device, dict)):
+        return device['name'] if 'name' in device else device['uid'].rsplit('/', 1)[-1]
+    if device.startswith('/zport/dmd/'):
+        return device.rsplit('/', 1)[-1]
+    return device
+
+
+def _organizer_uid(path, root):
+    '''Turn an organizer path such as /Server/Linux into a full uid under root'''
+    if path.startswith('/zport/dmd/'):
+        return path.rstrip('/')
+    return (root + '/' + path.strip('/')).rstrip('/')
+
+
+def _ref_values(value, attr):
+    '''Pull attr out of a reference dict, or out of every dict of a list of them'''
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return [v for ref in value for v in _ref_values(ref, attr)]
+    if isinstance(value, dict):
+        return [value.get(attr)]
+    return [value]
+
+
+class OrganizerTree(object):
+    '''An in memory organizer hierarchy indexed by uid and by path
+    '''
+    def __init__(self, root):
+        self.root = root
+        self.crawled = None
+        self.dirty = set()
+        self.__nodes = {root: dict(uid=root, name=root.rsplit('/', 1)[-1], path='/', count=None,
+                                   leaf=False, parent=None, children=[])}
+        self.__paths = {'/': root}
+
+    def __contains__(self, uid):
+        return uid in self.__nodes
+
+    def __len__(self):
+        return len(self.__nodes)
+
+    def node(self, uid):
+        '''Return the node for a uid'''
+        return self.__nodes[uid]
+
+    def find(self, path):
+        '''Return the node for a path relative to the root such as /Server/Linux, or None'''
+        uid = self.__paths.get('/' + path.strip('/'))
+        return self.__nodes[uid] if uid else None
+
+    def children(self, uid):
+        '''Return the child nodes of uid'''
+        return [self.__nodes[child] for child in self.__nodes[uid]['children']]
+
+    def walk(self, uid=None):
+        '''Iterate breadth first over uid and everything below it'''
+        pending = deque([uid or self.root])
+        while pending:
+            node = self.__nodes[pending.popleft()]
+            pending.extend(node['children'])
+            yield node
+
+    def set_children(self, uid, children):
+        '''Replace the children of uid with nodes as returned by asyncGetTree'''
+        for node in list(self.walk(uid))[1:]:
+            del self.__nodes[node['uid']]
+            self.__paths.pop(node['path'], None)
+        self.__nodes[uid]['children'] = list()
+        for child in children:
+            text = child.get('text')
+            node = dict(uid=child['uid'],
+                        name=text.get('text') if isinstance(text, dict) else text,
+                        path=child['uid'][len(self.root):] or '/',
+                        count=text.get('count') if isinstance(text, dict) else None,
+                        leaf=bool(child.get('leaf')),
+                        parent=uid,
+                        children=[])
+            self.__nodes[node['uid']] = node
+            self.__paths[node['path']] = node['uid']
+            self.__nodes[uid]['children'].append(node['uid'])
+
+
+class Record(object):
+    '''
+    compact, read only view of a router result dict
+
+    The fields a subclass lists in __slots__ are stored as plain attributes, every
+    other key is kept as a single JSON string and only decoded when accessed.
+    '''
+    __slots__ = ('_rest',)
+
+    def __init__(self, data):
+        rest = dict()
+        fields = self.__class__.__slots__
+        for key, value in data.items():
+            if key in fields:
+                object.__setattr__(self, key, value)
+            else:
+                rest[key] = value
+        object.__setattr__(self, '_rest', json.dumps(rest, separators=(',', ':')) if rest else None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('%s is read only' % self.__class__.__name__)
+
+    def __getattr__(self, name):
+        if not name.startswith('_'):
+            rest = self._extra()
+            if name in rest:
+                return rest[name]
+        raise AttributeError(name)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.to_dict())
+
+    def __eq__(self, other):
+        return isinstance(other, Record) and self.to_dict() == other.to_dict()
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
 
-    def get_devices(self, device_class='/zport/dmd/Devices', limit=None):
+    def _extra(self):
+        '''Decode the keys that have no slot'''
+        return json.loads(self._rest) if self._rest else {}
+
+    def get(self, key, default=None):
+        '''Dict style get'''
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            return default
+
+    def to_dict(self):
+        '''Convert back to the dict the router returned'''
+        data = self._extra()
+        for field in self.__class__.__slots__:
+            if field != '_rest' and hasattr(self, field):
+                data[field] = object.__getattribute__(self, field)
+        return data
+
+
+class DeviceRecord(Record):
+    '''A device returned by getDevices
+    '''
+    __slots__ = ('uid', 'name', 'uuid', 'ipAddressString', 'productionState', 'collector', 'priority')
+
+
+class EventRecord(Record):
+    '''An event returned by the EventsRouter query
+    '''
+    __slots__ = ('evid', 'device', 'component', 'eventClass', 'severity', 'eventState', 'summary', 'count',
+                 'firstTime', 'lastTime')
+
+
+class ComponentRecord(Record):
+    '''A component returned by getComponents
+    '''
+    __slots__ = ('uid', 'name', 'meta_type', 'status', 'monitored', 'severity')
+
+
+class RouterClient(object):
+    '''
+    direct access to every method of one Zenoss router
+
+    Zenoss creates one the first time an attribute such as device_router or
+    events_router is used. Calling a method with keyword arguments sends them as
+    the data of the call, positional arguments are sent as they are. The clients
+    of the device, events, event classes, triggers and properties routers also
+    carry the library methods for their router, which Zenoss hands calls on to.
+
+    usage::
+        >>> zen.device_router.getDevices(uid='/zport/dmd/Devices/Network', keys=['name'])
+        {u'devices': [...], u'hash': u'...', u'success': True, u'totalCount': 12}
+        >>> zen.device_router.asyncGetTree('/zport/dmd/Locations')
+        [...]
+    '''
+    def __init__(self, client, router, host, request, batch, stream, # pylint: disable=R0913
+                 concurrently, organizer_changed):
+        self.router = router
+        self._client = client
+        self._host = host
+        self._request = request
+        self._batch = batch
+        self._stream = stream
+        self._concurrently = concurrently
+        self._organizer_changed = organizer_changed
+
+    def __getattr__(self, method):
+        if method.startswith('_'):
+            raise AttributeError(method)
+
+        def call(*args, **kwargs):
+            '''Call the router method'''
+            return self._request(self.router, method, list(args) if args else [kwargs])
+        call.__name__ = str(method)
+        setattr(self, method, call)
+        return call
+
+
+class DeviceRouterClient(RouterClient):
+    '''devices, their organizers and components, available as Zenoss.device_router'''
+    def __init__(self, *args):
+        super(DeviceRouterClient, self).__init__(*args)
+        self.__index = None
+
+    def get_devices(self, device_class='/zport/dmd/Devices', limit=None, keys=None, params=None, # pylint: disable=R0913
+                    records=False):
         '''Get a list of all devices.
+            keys limits the attributes the server returns for every device, such as ['uid', 'name'].
+            params filters the devices on the server, such as {'name': 'web', 'ipAddress': '10.1.'}.
+            records returns the devices as compact DeviceRecord objects instead of dicts.
 
         '''
         log.info('Getting all devices')
-        return self.__router_request('DeviceRouter', 'getDevices',
-                                     data=[{'uid': device_class, 'params': {}, 'limit': limit}])
+        data = {'uid': device_class, 'params': params or {}, 'limit': limit}
+        if keys:
+            data['keys'] = list(keys)
+        result = self._request('DeviceRouter', 'getDevices', data=[data])
+        if records:
+            result['devices'] = [DeviceRecord(device) for device in result['devices']]
+        return result
+
+    def iter_devices(self, device_class='/zport/dmd/Devices', keys=None, params=None, records=False):
+        '''
+        yield devices while the getDevices response is still being downloaded
+
+        Only one device at a time is decoded, so memory use does not grow with the
+        size of the inventory. The result hash is not available in this mode.
+
+        usage::
+            >>> for device in zen.iter_devices(keys=['uid', 'name']):
+            ...     print(device['name'])
+        '''
+        data = {'uid': device_class, 'params': params or {}, 'limit': None}
+        if keys:
+            data['keys'] = list(keys)
+        log.info('Streaming devices of %s', device_class)
+        for device in self._stream('DeviceRouter', 'getDevices', [data], 'devices'):
+            yield DeviceRecord(device) if records else device
+
+    def build_inventory_index(self, device_class='/zport/dmd/Devices'):
+        '''
+        build a local search index over the device inventory
+
+        The index is kept up to date for devices this client removes, moves,
+        renames, sets info on or resets the ip of, including the moves and group
+        changes made by reconcile_devices.
+
+        :param device_class: organizer holding the devices to index
+        :type device_class: string
+        :return: the index
+        :rtype: InventoryIndex
+
+        usage::
+            >>> index = zen.build_inventory_index()
+            >>> [d['name'] for d in index.by_cidr('10.1.0.0/16')]
+            [u'db01', u'web01']
+        '''
+        self.__index = InventoryIndex(self.get_devices(device_class, keys=INDEX_KEYS)['devices'])
+        return self.__index
+
+    def __index_changed(self, device, removed=False, new_name=None):
+        '''Bring the inventory index in line after the client changed a device
+        '''
+        if self.__index is None:
+            return
+        self.__index.remove(device['uid'])
+        if not removed:
+            try:
+                self.__index.add(self.find_device(new_name or device['name'], keys=INDEX_KEYS))
+            except Exception: # pylint: disable=W0703
+                log.error('Unable to refresh %s in the inventory index', new_name or device['name'])
+
+    def __refresh_index(self, devices, workers):
+        '''Bring the inventory index in line after many devices changed, looking them up together
+        '''
+        found = self.find_devices([device['name'] for device in devices], keys=INDEX_KEYS, workers=workers)
+        for device in devices:
+            self.__index.remove(device['uid'])
+            if device['name'] in found:
+                self.__index.add(found[device['name']])
+
+    def get_devices_hash(self, device_class='/zport/dmd/Devices', params=None):
+        '''
+        return the hash getDevices reports for a set of devices without downloading them
+
+        Only a single device with just its uid is requested; the hash covers the
+        whole result set, so it changes whenever the inventory does.
+
+        :param device_class: organizer holding the devices
+        :type device_class: string
+        :param params: server side filters, as for get_devices
+        :type params: dict
+        :return: the inventory hash
+        :rtype: string
+        '''
+        return self.get_devices(device_class, limit=1, keys=['uid'], params=params)['hash']
+
+    def get_devices_if_changed(self, known_hash, device_class='/zport/dmd/Devices', **kwargs):
+        '''
+        fetch the devices only when the inventory hash differs from known_hash
+
+        :param known_hash: hash of the inventory held by the caller, such as the
+            hash key of an earlier get_devices result
+        :type known_hash: string
+        :param device_class: organizer holding the devices
+        :type device_class: string
+        :return: the get_devices result, or None when nothing changed
+        :rtype: dict
+
+        usage::
+            >>> inventory = zen.get_devices(keys=['uid', 'name'])
+            >>> zen.get_devices_if_changed(inventory['hash'], keys=['uid', 'name']) is None
+            True
+        '''
+        if known_hash is not None and self.get_devices_hash(device_class, kwargs.get('params')) == known_hash:
+            log.info('Devices under %s unchanged', device_class)
+            return None
+        return self.get_devices(device_class, **kwargs)
+
+    def save_inventory_snapshot(self, path, device_class='/zport/dmd/Devices', columns=SNAPSHOT_DEVICE_COLUMNS,
+                                components=False, zproperties=False, workers=8): # pylint: disable=R0913
+        '''
+        write the device inventory to a compact columnar snapshot file
+
+        Components and zProperty dumps are fetched concurrently. Named zProperties are
+        resolved with get_zproperty_values, so only devices overriding them cost a fetch.
+
+        :param path: file to write the snapshot to
+        :type path: string
+        :param device_class: organizer to take the inventory of
+        :type device_class: string
+        :param columns: device attributes to store, None stores every attribute returned
+        :type columns: tuple
+        :param components: also store the components of every device
+        :type components: boolean
+        :param zproperties: also store the locally set zProperties of every device, True for every
+            zProperty, one dump per device, or a list of the zProperty ids to store, which takes
+            far fewer requests
+        :type zproperties: boolean
+        :return: the snapshot that was written
+        :rtype: InventorySnapshot
+
+        usage::
+            >>> snap = zen.save_inventory_snapshot('/var/tmp/inventory-1200.snap')
+            >>> len(snap.table('devices'))
+            8042
+        '''
+        log.info('Saving inventory snapshot of %s to %s', device_class, path)
+        devices = self.get_devices(device_class, keys=columns)['devices']
+        if columns:
+            devices = [dict((key, device.get(key)) for key in columns) for device in devices]
+        # uuid survives moves and renames, fall back on uid when the server did not send it
+        key = ('uuid',) if devices and all(device.get('uuid') for device in devices) else ('uid',)
+        tables = {'devices': (key, devices)}
+        uids = [device['uid'] for device in devices]
+        if components:
+            results = self._concurrently(lambda uid: self.get_components_by_uid(uid=uid, limit=None), uids, workers)
+            rows = list()
+            for uid, result in zip(uids, results):
+                for component in result.get('data', []):
+                    component['device'] = uid
+                    rows.append(component)
+            tables['components'] = (('uid',), rows)
+        if zproperties is True:
+            # Listing overrides of every zProperty costs more than one dump per device
+            dumps = self._concurrently(self._client.get_zproperties, uids, workers)
+            rows = [dict(uid=uid, id=prop['id'], value=prop.get('value')) for uid, dump in zip(uids, dumps)
+                    for prop in dump.get('data', []) if prop.get('islocal')]
+            tables['zproperties'] = (('uid', 'id'), rows)
+        elif zproperties:
+            values = self._client.get_zproperty_values(uids, zproperties, workers=workers, details=True)
+            rows = [dict(uid=uid, id=name, value=prop['value']) for uid in uids
+                    for name, prop in sorted(values[uid].items()) if prop['islocal']]
+            tables['zproperties'] = (('uid', 'id'), rows)
+        write_snapshot(path, tables)
+        return InventorySnapshot(path)
 
     def get_components(self, device_name, **kwargs):
         '''Get components for a device given the name
@@ -105,19 +1216,31 @@ class Zenoss(object):
 
     def get_components_by_uid(self, uid=None, meta_type=None, keys=None,
                               start=0, limit=50, page=0,
-                              sort='name', dir='ASC', name=None):
+                              sort='name', dir='ASC', name=None, records=False):
         '''Get components for a device given the uid
+            records returns the components as compact ComponentRecord objects instead of dicts.
         '''
         data = dict(uid=uid, meta_type=meta_type, keys=keys, start=start,
                     limit=limit, page=page, sort=sort, dir=dir, name=name)
-        return self.__router_request('DeviceRouter', 'getComponents', [data])
+        result = self._request('DeviceRouter', 'getComponents', [data])
+        if records:
+            result['data'] = [ComponentRecord(component) for component in result.get('data', [])]
+        return result
 
-    def find_device(self, device_name):
+    def find_device(self, device_name, keys=None):
         '''Find a device by name.
+            keys limits the attributes returned for the device, by default all are returned.
+            The server narrows the inventory by name first, the exact match is confirmed here.
 
         '''
         log.info('Finding device %s', device_name)
-        all_devices = self.get_devices()
+        if keys and 'name' not in keys:
+            keys = tuple(keys) + ('name',)
+        all_devices = self.search_devices(name=device_name, keys=keys)
+        if device_name not in [d['name'] for d in all_devices['devices']] and \
+                all_devices.get('totalCount', 0) > len(all_devices['devices']):
+            # Too many partial matches for the first page, fetch them all
+            all_devices = self.search_devices(name=device_name, keys=keys, limit=None)
 
         try:
             device = [d for d in all_devices['devices'] if d['name'] == device_name][0]
@@ -127,12 +1250,133 @@ class Zenoss(object):
             return device
         except IndexError:
             log.error('Cannot locate device %s', device_name)
-            raise Exception('Cannot locate device %s' % device_name)
+            raise DeviceNotFound('Cannot locate device %s' % device_name)
+
+    def find_devices(self, device_names, keys=DEVICE_LOOKUP_KEYS, workers=8, scan_above=200):
+        '''
+        find many devices by exact name
+
+        Each name is looked up with its own server side filtered request, run
+        concurrently. For more than scan_above names a single projected scan of
+        the inventory is cheaper and is used instead.
+
+        :param device_names: names of the devices
+        :type device_names: list
+        :param keys: device attributes to return
+        :type keys: tuple
+        :return: name mapped to device dict, names that do not exist are left out
+        :rtype: dict
+
+        usage::
+            >>> zen.find_devices(['web01', 'web02'])
+            {'web01': {u'uid': u'/zport/dmd/Devices/Server/Linux/devices/web01', u'name': u'web01', 'hash': ...},
+             'web02': {...}}
+        '''
+        if keys and 'name' not in keys:
+            keys = tuple(keys) + ('name',)
+        wanted = set(device_names)
+        if len(wanted) > scan_above:
+            inventory = self.get_devices(keys=keys)
+            found = [d for d in inventory['devices'] if d['name'] in wanted]
+            for device in found:
+                device['hash'] = inventory['hash']
+        else:
+            def lookup(name):
+                '''Find one device, None when it is missing'''
+                try:
+                    return self.find_device(name, keys=keys)
+                except DeviceNotFound:
+                    return None
+            found = [d for d in self._concurrently(lookup, sorted(wanted), workers) if d]
+        for name in wanted.difference(d['name'] for d in found):
+            log.error('Cannot locate device %s', name)
+        return dict((d['name'], d) for d in found)
+
+    def search_devices(self, name=None, ip_address=None, device_class='/zport/dmd/Devices',
+                       production_state=None, limit=50, keys=DEVICE_LOOKUP_KEYS):
+        '''
+        search devices with the filters applied on the server
+
+        Zenoss matches name and ip_address as partial strings, so the result can
+        hold more devices than the exact one searched for.
+
+        :param name: device name or part of it
+        :type name: string
+        :param ip_address: ip address or part of it
+        :type ip_address: string
+        :param device_class: organizer to search below
+        :type device_class: string
+        :param production_state: production state or list of them
+        :type production_state: int
+        :param limit: maximum number of devices to return
+        :type limit: int
+        :param keys: device attributes to return
+        :type keys: tuple
+        :return: getDevices result dict
+        :rtype: dict
+        '''
+        params = dict()
+        if name is not None:
+            params['name'] = name
+        if ip_address is not None:
+            params['ipAddress'] = ip_address
+        if production_state is not None:
+            params['productionState'] = production_state if isinstance(production_state, list) \
+                else [production_state]
+        return self.get_devices(_organizer_uid(device_class, '/zport/dmd/Devices'), limit=limit, keys=keys,
+                                params=params)
 
     def device_uid(self, device):
         '''Helper method to retrieve the device UID for a given device name
         '''
-        return self.find_device(device)['uid']
+        return self.__resolve_device(device)['uid']
+
+    def device(self, device_name, keys=None):
+        '''
+        look a device up once and return a handle to work with it
+
+        Every method of the handle reuses the uid and hash found here, and the
+        name based methods of Zenoss accept the handle in place of a name.
+
+        :param device_name: name of the device
+        :type device_name: string
+        :param keys: device attributes to fetch, by default all are fetched
+        :type keys: tuple
+        :return: handle for the device
+        :rtype: Device
+
+        usage::
+            >>> web01 = zen.device('web01')
+            >>> web01.set_rhel_release(7.9)
+            >>> web01.get_load_average()
+            [0.12, 0.2, 0.18]
+        '''
+        return Device(self._client, self.find_device(device_name, keys=keys))
+
+    def __resolve_device(self, device, keys=DEVICE_LOOKUP_KEYS):
+        '''Turn a device name, uid, Device handle or device dict into a dict holding at least keys.
+            Only names, and handles or dicts missing some of the keys, cost a lookup.
+        '''
+        if isinstance(device, (Device, dict)) and 'uid' in device:
+            if all(key in device for key in keys):
+                if 'hash' in device:
+                    return device
+                if isinstance(device, Device):
+                    device.attributes['hash'] = None
+                    return device
+                # Dicts from get_devices or an InventoryIndex carry no hash
+                return dict(device, hash=None)
+            found = self.find_device(device['name'] if 'name' in device else device['uid'].rsplit('/', 1)[-1],
+                                     keys=tuple(keys) + DEVICE_LOOKUP_KEYS)
+            if isinstance(device, Device):
+                device.attributes.update(found)
+                return device
+            return found
+        if device.startswith('/zport/dmd/'):
+            if all(key in DEVICE_LOOKUP_KEYS for key in keys):
+                return dict(uid=device, name=device.rsplit('/', 1)[-1], hash=None)
+            return self.find_device(device.rsplit('/', 1)[-1], keys=tuple(keys) + DEVICE_LOOKUP_KEYS)
+        return self.find_device(device, keys=keys)
 
     def add_device(self, device_name, device_class, collector='localhost'):
         '''Add a device.
@@ -140,34 +1384,38 @@ class Zenoss(object):
         '''
         log.info('Adding %s', device_name)
         data = dict(deviceName=device_name, deviceClass=device_class, model=True, collector=collector)
-        return self.__router_request('DeviceRouter', 'addDevice', [data])
+        return self._request('DeviceRouter', 'addDevice', [data])
 
     def remove_device(self, device_name):
         '''Remove a device.
 
         '''
         log.info('Removing %s', device_name)
-        device = self.find_device(device_name)
+        device = self.__resolve_device(device_name)
         data = dict(uids=[device['uid']], hashcheck=device['hash'], action='delete')
-        return self.__router_request('DeviceRouter', 'removeDevices', [data])
+        result = self._request('DeviceRouter', 'removeDevices', [data])
+        self.__index_changed(device, removed=True)
+        return result
 
     def move_device(self, device_name, organizer):
         '''Move the device the organizer specified.
 
         '''
         log.info('Moving %s to %s', device_name, organizer)
-        device = self.find_device(device_name)
+        device = self.__resolve_device(device_name)
         data = dict(uids=[device['uid']], hashcheck=device['hash'], target=organizer)
-        return self.__router_request('DeviceRouter', 'moveDevices', [data])
+        result = self._request('DeviceRouter', 'moveDevices', [data])
+        self.__index_changed(device)
+        return result
 
     def set_prod_state(self, device_name, prod_state):
         '''Set the production state of a device.
 
         '''
         log.info('Setting prodState on %s to %s', device_name, prod_state)
-        device = self.find_device(device_name)
+        device = self.__resolve_device(device_name)
         data = dict(uids=[device['uid']], prodState=prod_state, hashcheck=device['hash'])
-        return self.__router_request('DeviceRouter', 'setProductionState', [data])
+        return self._request('DeviceRouter', 'setProductionState', [data])
 
     def set_maintenance(self, device_name):
         '''Helper method to set prodState for device so that it does not alert.
@@ -186,13 +1434,13 @@ class Zenoss(object):
 
         '''
         log.info('Setting ProductInfo on %s', device_name)
-        device = self.find_device(device_name)
+        device = self.__resolve_device(device_name)
         data = dict(uid=device['uid'],
                     hwManufacturer=hw_manufacturer,
                     hwProductName=hw_product_name,
                     osManufacturer=os_manufacturer,
                     osProductName=os_product_name)
-        return self.__router_request('DeviceRouter', 'setProductInfo', [data])
+        return self._request('DeviceRouter', 'setProductInfo', [data])
 
     def set_rhel_release(self, device_name, release):
         '''Sets the proper release of RedHat Enterprise Linux.'''
@@ -200,8 +1448,8 @@ class Zenoss(object):
             log.error("RHEL release must be a float")
             return {u'success': False}
         log.info('Setting RHEL release on %s to %s', device_name, release)
-        device = self.find_device(device_name)
-        return self.set_product_info(device_name, device['hwManufacturer']['name'], device['hwModel']['name'], 'RedHat',
+        device = self.__resolve_device(device_name, keys=DEVICE_LOOKUP_KEYS + ('hwManufacturer', 'hwModel'))
+        return self.set_product_info(device, device['hwManufacturer']['name'], device['hwModel']['name'], 'RedHat',
                                      'RHEL {}'.format(release))
 
     def set_device_info(self, device_name, data):
@@ -209,118 +1457,151 @@ class Zenoss(object):
             This method accepts any keyword argument for the property that you wish to set.
 
         '''
-        data['uid'] = self.find_device(device_name)['uid']
-        return self.__router_request('DeviceRouter', 'setInfo', [data])
+        device = self.__resolve_device(device_name)
+        data['uid'] = device['uid']
+        result = self._request('DeviceRouter', 'setInfo', [data])
+        self.__index_changed(device)
+        return result
 
     def remodel_device(self, device_name):
         '''Submit a job to have a device remodeled.
 
         '''
-        return self.__router_request('DeviceRouter', 'remodel', [dict(uid=self.find_device(device_name)['uid'])])
+        return self._request('DeviceRouter', 'remodel', [dict(uid=self.device_uid(device_name))])
 
     def set_collector(self, device_name, collector):
         '''Set collector for device.
 
         '''
-        device = self.find_device(device_name)
+        device = self.__resolve_device(device_name)
         data = dict(uids=[device['uid']], hashcheck=device['hash'], collector=collector)
-        return self.__router_request('DeviceRouter', 'setCollector', [data])
+        return self._request('DeviceRouter', 'setCollector', [data])
 
     def rename_device(self, device_name, new_name):
         '''Rename a device.
 
         '''
-        data = dict(uid=self.find_device(device_name)['uid'], newId=new_name)
-        return self.__router_request('DeviceRouter', 'renameDevice', [data])
+        device = self.__resolve_device(device_name)
+        data = dict(uid=device['uid'], newId=new_name)
+        result = self._request('DeviceRouter', 'renameDevice', [data])
+        self.__index_changed(device, new_name=new_name)
+        return result
 
     def reset_ip(self, device_name, ip_address=''):
         '''Reset IP address(es) of device to the results of a DNS lookup or a manually set address.
 
         '''
-        device = self.find_device(device_name)
+        device = self.__resolve_device(device_name)
         data = dict(uids=[device['uid']], hashcheck=device['hash'], ip=ip_address)
-        return self.__router_request('DeviceRouter', 'resetIp', [data])
-
-    def get_events(self, device=None, limit=100, component=None,
-                   severity=None, event_class=None, start=0,
-                   event_state=None, sort='severity', direction='DESC'):
-        '''Find current events.
-             Returns a list of dicts containing event details. By default
-             they are sorted in descending order of severity.  By default,
-             severity {5, 4, 3, 2} and state {0, 1} are the only events that
-             will appear.
-
-        '''
-        if severity is None:
-            severity = [5, 4, 3, 2]
-        if event_state is None:
-            event_state = [0, 1]
-        data = dict(start=start, limit=limit, dir=direction, sort=sort)
-        data['params'] = dict(severity=severity, eventState=event_state)
-        if device is not None:
-            data['params']['device'] = device
-        if component is not None:
-            data['params']['component'] = component
-        if event_class is not None:
-            data['params']['eventClass'] = event_class
-        log.info('Getting events for %s', data)
-        return self.__router_request(
-            'EventsRouter', 'query', [data])['events']
-
-    def get_event_detail(self, event_id):
-        '''Find specific event details
-
-        '''
-        data = dict(evid=event_id)
-        return self.__router_request('EventsRouter', 'detail', [data])
-
-    def write_log(self, event_id, message):
-        '''Write a message to the event's log
-
-        '''
-        data = dict(evid=event_id, message=message)
-        return self.__router_request('EventsRouter', 'write_log', [data])
-
-    def change_event_state(self, event_id, state):
-        '''Change the state of an event.
-
-        '''
-        log.info('Changing eventState on %s to %s', event_id, state)
-        return self.__router_request('EventsRouter', state, [{'evids': [event_id]}])
-
-    def ack_event(self, event_id):
-        '''Helper method to set the event state to acknowledged.
-
-        '''
-        return self.change_event_state(event_id, 'acknowledge')
-
-    def close_event(self, event_id):
-        '''Helper method to set the event state to closed.
-
-        '''
-        return self.change_event_state(event_id, 'close')
-
-    def create_event_on_device(self, device_name, severity, summary,
-                               component='', evclasskey='', evclass=''):
-        '''Manually create a new event for the device specified.
+        result = self._request('DeviceRouter', 'resetIp', [data])
+        self.__index_changed(device)
+        return result
 
-        '''
-        log.info('Creating new event for %s with severity %s', device_name, severity)
-        if severity not in ('Critical', 'Error', 'Warning', 'Info', 'Debug', 'Clear'):
-            raise Exception('Severity %s is not valid.' % severity)
-        data = dict(device=device_name, summary=summary, severity=severity,
-                    component=component, evclasskey=evclasskey, evclass=evclass)
-        return self.__router_request('EventsRouter', 'add_event', [data])
+    def reconcile_devices(self, desired, device_class='/zport/dmd/Devices', dry_run=False, workers=8):
+        '''
+        bring devices in line with a declared state using as few router calls as possible
+
+        The current state of every device is fetched with a single getDevices call.
+        Devices needing the same change are handled by one multi-uid router call and
+        independent calls run concurrently. Moves run last as they change device uids.
+
+        :param desired: device name mapped to a dict with any of device_class, collector,
+            prod_state, groups (list of group paths) and product_info (dict of the
+            set_product_info keyword arguments)
+        :type desired: dict
+        :param device_class: organizer holding the devices
+        :type device_class: string
+        :param dry_run: only return the plan, do not change anything
+        :type dry_run: boolean
+        :param workers: number of router calls to run at once
+        :type workers: int
+        :return: dict with the planned actions and the names of devices that do not exist
+        :rtype: dict
 
-    def get_load_average(self, device):
-        '''Returns the current 1, 5 and 15 minute load averages for a device.
-        '''
-        dsnames = ('laLoadInt1_laLoadInt1', 'laLoadInt5_laLoadInt5', 'laLoadInt15_laLoadInt15')
-        result = self.get_rrd_values(device=device, dsnames=dsnames)
-        def normalize_load(load):
-            '''Convert raw RRD load average to something reasonable so that it matches output from /proc/loadavg'''
-            return round(float(load) / 100.0, 2)
-        return [normalize_load(l) for l in result.values()]
+        usage::
+            >>> zen.reconcile_devices({'web01': {'collector': 'remote1', 'prod_state': 1000}}, dry_run=True)
+            {'actions': [{'router': 'DeviceRouter', 'method': 'setCollector', 'devices': ['web01'],
+                          'data': {'uids': [...], 'collector': 'remote1', 'hashcheck': ...}}],
+             'missing': []}
+        '''
+        inventory = self.get_devices(device_class, keys=DEVICE_LOOKUP_KEYS + (
+            'collector', 'productionState', 'groups', 'hwManufacturer', 'hwModel', 'osManufacturer', 'osModel'))
+        current = dict((d['name'], d) for d in inventory['devices'])
+        hashcheck = inventory.get('hash')
+        grouped = dict()
+        product_info = list()
+        missing = list()
+
+        def add(method, value, device):
+            '''Queue a device for the multi-uid call sharing method and value'''
+            grouped.setdefault((method, value), []).append(device)
+
+        for name, state in sorted(desired.items()):
+            if name not in current:
+                log.error('Cannot reconcile missing device %s', name)
+                missing.append(name)
+                continue
+            device = current[name]
+            if state.get('collector') is not None and state['collector'] != device.get('collector'):
+                add('setCollector', state['collector'], device)
+            if state.get('prod_state') is not None and state['prod_state'] != device.get('productionState'):
+                add('setProductionState', state['prod_state'], device)
+            if state.get('groups') is not None:
+                have = set(_ref_values(device.get('groups'), 'uid'))
+                want = set(_organizer_uid(group, '/zport/dmd/Groups') for group in state['groups'])
+                for group in sorted(want - have):
+                    add('addToGroup', group, device)
+                for group in sorted(have - want):
+                    add('removeFromGroup', group, device)
+            if state.get('product_info'):
+                info = state['product_info']
+                have = dict(hw_manufacturer=_ref_values(device.get('hwManufacturer'), 'name'),
+                            hw_product_name=_ref_values(device.get('hwModel'), 'name'),
+                            os_manufacturer=_ref_values(device.get('osManufacturer'), 'name'),
+                            os_product_name=_ref_values(device.get('osModel'), 'name'))
+                if any([info[key]] != have[key] for key in info):
+                    product_info.append((device, info))
+            if state.get('device_class') is not None:
+                target = _organizer_uid(state['device_class'], '/zport/dmd/Devices')
+                if target != _uid_organizer(device['uid']):
+                    add('moveDevices', target, device)
+
+        first, last = list(), list()
+        for (method, value), devices in sorted(grouped.items()):
+            data = dict(uids=[d['uid'] for d in devices], hashcheck=hashcheck)
+            if method == 'setCollector':
+                data['collector'] = value
+            elif method == 'setProductionState':
+                data['prodState'] = value
+            elif method == 'addToGroup':
+                method, data['target'] = 'moveDevices', value
+            elif method == 'removeFromGroup':
+                method, data['uid'], data['action'] = 'removeDevices', value, 'remove'
+            elif method == 'moveDevices':
+                data['target'] = value
+            action = dict(router='DeviceRouter', method=method, data=data, devices=[d['name'] for d in devices])
+            (last if method == 'moveDevices' and value.startswith('/zport/dmd/Devices') else first).append(action)
+        for device, info in product_info:
+            data = dict(uid=device['uid'],
+                        hwManufacturer=info.get('hw_manufacturer'),
+                        hwProductName=info.get('hw_product_name'),
+                        osManufacturer=info.get('os_manufacturer'),
+                        osProductName=info.get('os_product_name'))
+            first.append(dict(router='DeviceRouter', method='setProductInfo', data=data, devices=[device['name']]))
+
+        if not dry_run:
+            for actions in (first, last):
+                results = self._concurrently(
+                    lambda action: self._request(action['router'], action['method'], [action['data']]),
+                    actions, workers)
+                for action, result in zip(actions, results):
+                    action['result'] = result
+            moved = set(name for action in first + last if action['method'] in ('moveDevices', 'removeDevices')
+                        for name in action['devices'])
+            if moved and self.__index is not None:
+                self.__refresh_index([current[name] for name in sorted(moved)], workers)
+        log.info('Reconciled %s devices with %s router calls', len(desired), len(first) + len(last))
+        return dict(actions=first + last, missing=missing)
 
     def add_device_class(self, name, description="", path=""):
         '''
@@ -351,49 +1632,17 @@ class Zenoss(object):
         '''
         base_org = "/zport/dmd/Devices%s" % path
         data = dict(contextUid=base_org, id=name, description=description, type="organizer")
-        return self.__router_request('DeviceRouter', 'addDeviceClassNode', [data])
+        result = self._request('DeviceRouter', 'addDeviceClassNode', [data])
+        self._organizer_changed(base_org)
+        return result
 
-    def add_event_class(self, name, description="", path=""):
+    def add_group(self, group, description="", path=""):
         '''
-        create a new event class
+        add group
 
-        :param name: the endpoint name of the event class
-        :type name: string
-        :param description: description the new event class
-        :type description: string
-        :param path: path to where to put new event class
-        :type path: string
-        :return: zenoss success dict, with nodeConfig key showing the new event class details
-        :rtype: dict
-
-        usage::
-            >>> zen.add_event_class("Test", path="/Net", description="Testing")
-            {u'nodeConfig': {u'children': [],
-                 u'count': 0,
-                 u'hidden': False,
-                 u'iconCls': u'tree-severity-icon-small-clear',
-                 u'id': u'.zport.dmd.Events.Net.Testing',
-                 u'leaf': True,
-                 u'path': u'Events/Net/Test',
-                 u'text': {u'count': 0,
-                 u'description': u'Testing',
-                 u'hasTransform': False,
-                 u'text': u'Testing'},
-                 u'uid': u'/zport/dmd/Events/Net/Testing',
-                 u'uuid': u'...'},
-             u'success': True}
-        '''
-        base_org = "/zport/dmd/Events%s" % path
-        data = dict(contextUid=base_org, id=name, description=description, type="organizer")
-        return self.__router_request('EventClassesRouter', 'addNode', [data])
-
-    def add_group(self, group, description="", path=""):
-        '''
-        add group
-
-        :param group: name of group to be added
-        :type group: string
-        :param description: description for the group
+        :param group: name of group to be added
+        :type group: string
+        :param description: description for the group
         :type description: string
         :param path: path to the group, if group is to be placed in suborganizers
         :type path: string
@@ -418,19 +1667,9 @@ class Zenoss(object):
         log.info('Adding Group %s', group)
         base_org = "/zport/dmd/Groups/%s" % path
         data = dict(type='organizer', contextUid=base_org, id=group, description=description)
-        return self.__router_request('DeviceRouter', 'addNode', [data])
-
-    def add_hardware_product(self, product_name, manufacturer, product_type, part_number="",
-                             product_keys="", description=""):
-        '''
-        Add Hardware
-        '''
-        log.info('Adding Hardware Product %s', product_name)
-        tmp = dict(prodname=product_name, uid="/zport/dmd/Manufacturers/%s" % manufacturer,
-                   type=product_type, description=description, partno=part_number,
-                   prodkeys=product_keys)
-        data = dict(params=tmp)
-        return self.__router_request('ManufacturersRouter', 'addNewProduct', [data])
+        result = self._request('DeviceRouter', 'addNode', [data])
+        self._organizer_changed(base_org)
+        return result
 
     def add_location(self, location_name, path="", description="", address=""):
         '''
@@ -470,67 +1709,8 @@ class Zenoss(object):
         base_org = "/zport/dmd/Locations%s" % path
         data = dict(type='organizer', contextUid=base_org, id=location_name, description=description,
                     address=address)
-        return self.__router_request('DeviceRouter', 'addLocationNode', [data])
-
-    def add_notification(self, name, action):
-        '''
-        add a new notification
-
-        :param name: name of the notification
-        :type name: string
-        :param action: the notifications action
-        :type action: string
-        :return: zenoss success dict where the data key holds the whole notifications config details
-        :rtype: dict
-        usage::
-            >>> zen.add_notification("Testing", "email")
-            {u'data':
-                {u'action': u'email',
-                u'content': {...},
-                  ...
-                },
-            u'success': True}
-        '''
-        data = dict(newId=name, action=action)
-        return self.__router_request('TriggersRouter', 'addNotification', [data])
-
-    def add_trigger(self, name, rules=None, users=None, enabled=True,
-                    global_manage=False, global_read=False, global_write=False):
-        '''
-        add a new trigger
-
-        :param name: name of new trigger
-        :type name: string
-        :param rule: event rule string
-        :type rule: string
-        :param users: list of dicts for user setting definitions
-        :type rule: list
-        :param enabled: is the trigger enabled
-        :type enabled: boolean
-        :param global_manage: is the trigger manageable by all, can it be deleted
-        :type global_manage: boolean
-        :param global_read: is the trigger readable by all, can it be seen
-        :type gloabl_read: boolean
-        :param global_write: is the trigger writable by all, can it be updated
-        :type global_write: boolean
-        :return: zenoss success dict
-        :rtype: dict
-
-
-        usage::
-            >>> zen.add_trigger('TEST')
-            {u'data': u'b0be2cf8-6182-4cc5-8b5c-545765869612', u'success': True}
-        '''
-        result = self.__router_request('TriggersRouter', 'addTrigger', [dict(newId=name)])
-        if not result['success']:
-            raise ZenossException("Unable to add trigger %s Reason: %s" % (name, result['msg']))
-        if rules:
-            update_result = self.update_trigger_rules(name, rules, users=users, enabled=enabled,
-                                                      global_manage=global_manage,
-                                                      global_read=global_read,
-                                                      global_write=global_write)
-            if not update_result['success']:
-                raise ZenossException("Unable to update rules for trigger %s" % name)
+        result = self._request('DeviceRouter', 'addLocationNode', [data])
+        self._organizer_changed(base_org)
         return result
 
     def get_locations(self, location='/zport/dmd/Locations', limit=None):
@@ -549,14 +1729,14 @@ class Zenoss(object):
                 u'totalCount': 1
             }
         '''
-        return self.__router_request('DeviceRouter', 'getLocations',
+        return self._request('DeviceRouter', 'getLocations',
                                      data=[{'uid': location, 'params': {}, 'limit': limit}])
 
     def get_groups(self, groups='/zport/dmd/Groups', limit=None):
         '''
         get details of infrastructure group
         '''
-        return self.__router_request('DeviceRouter', 'getGroups',
+        return self._request('DeviceRouter', 'getGroups',
                                      data=[{'uid': groups, 'params': {}, 'limit': limit}])
 
     def get_device_classes(self, path):
@@ -580,7 +1760,7 @@ class Zenoss(object):
             }]
         '''
         base_org = "/zport/dmd/Devices%s" % path
-        return self.__router_request('DeviceRouter', 'asyncGetTree', [base_org])
+        return self._request('DeviceRouter', 'asyncGetTree', [base_org])
 
     def get_device_class_template(self, path):
         '''
@@ -599,7 +1779,299 @@ class Zenoss(object):
             u'uid': u'/zport/dmd/Devices/rrdTemplates/Device'}]
         '''
         base_org = "/zport/dmd/Devices%s" % path
-        return self.__router_request('DeviceRouter', 'getTemplates', [base_org])
+        return self._request('DeviceRouter', 'getTemplates', [base_org])
+
+    def get_location_details(self, name, path=""):
+        '''
+        given a location return all the info about said location
+
+        :param name: location name
+        :type name: string
+        :param path: path to location
+        :return: dict of dict where data key has all the location details
+        :rtype: dict
+        ::
+            >>> zen.get_location_details("DataCenter1")
+            {u'data': {u'address': u'742 Evergreen Terrace',
+              u'description': u'',
+              u'events': {u'clear': {u'acknowledged_count': 0, u'count': 0},
+               u'critical': {u'acknowledged_count': 0, u'count': 1},
+               u'debug': {u'acknowledged_count': 0, u'count': 0},
+               u'error': {u'acknowledged_count': 1, u'count': 7},
+               u'info': {u'acknowledged_count': 0, u'count': 82},
+               u'warning': {u'acknowledged_count': 0, u'count': 8}},
+              u'id': u'Europe',
+              u'inspector_type': u'Location',
+              u'meta_type': u'Location',
+              u'name': u'/DataCenter1',
+              u'severity': u'critical',
+              u'uid': u'/zport/dmd/Locations/DataCenter1',
+              u'uuid': u'...'},
+             u'disabled': False,
+             u'success': True}
+        '''
+        uid = "/zport/dmd/Locations%s/%s" % (path, name)
+        return self._request('DeviceRouter', 'getInfo', data=[dict(uid=uid)])
+
+    def remove_device_class(self, name, path=""):
+        '''
+        remove a given device class from zenoss
+
+        :param name: name of device class to be removed
+        :type name: string
+        :param path: path to device class endpoint
+        :type path: string
+        :return: dict showing the status of the command
+        :rtype: dict
+        usage::
+            >>> zen.remove_device_class("Switch", path="/Network")
+            {u'msg': u"Deleted node '/zport/dmd/Devices/HTTP/Test'", u'success': True}
+        '''
+        base_org = "/zport/dmd/Devices%s" % path
+        data = dict(uid="%s/%s" % (base_org, name))
+        result = self._request('DeviceRouter', 'deleteNode', [data])
+        self._organizer_changed(base_org)
+        return result
+
+    def remove_group(self, group, path=""):
+        '''
+        Deletes a Group organizer
+        :param group: name of group to be deleted
+        :type group: string
+        :param path: path to organizer holding group
+        :type path: string
+        :return: zenoss success dict
+        :rtype: dict
+
+        usage::
+            >>> zen.remove_group("MyGroup")
+            {u'msg': u"Deleted node '/zport/dmd/Groups/MyGroup'", u'success': True}
+        '''
+        base_org = "/zport/dmd/Groups%s" % path
+        log.info('Removing Group %s', group)
+        data = dict(uid="%s/%s" % (base_org, group))
+        result = self._request('DeviceRouter', 'deleteNode', [data])
+        self._organizer_changed(base_org)
+        return result
+
+    def remove_locations(self, location, path=""):
+        '''
+        Deletes a Location organizer
+
+        :param location: name of the location to be remove
+        :type location: string
+        :param path: path to the location organizer
+        :type path: string
+        :return: zenoss success dict
+        :rtype: dict
+        usage::
+            >>> zen.remove_locations("Springfield")
+            {u'msg': u"Deleted node '/zport/dmd/Locations/Springfield'", u'success': True}
+        '''
+        base_org = "/zport/dmd/Locations%s" % path
+        log.info('Removing Location %s', location)
+        data = dict(uid="%s/%s" % (base_org, location))
+        result = self._request('DeviceRouter', 'deleteNode', [data])
+        self._organizer_changed(base_org)
+        return result
+
+
+class EventsRouterClient(RouterClient):
+    '''events, available as Zenoss.events_router'''
+    def get_events(self, device=None, limit=100, component=None,
+                   severity=None, event_class=None, start=0,
+                   event_state=None, sort='severity', direction='DESC', keys=None, records=False):
+        '''Find current events.
+             Returns a list of dicts containing event details. By default
+             they are sorted in descending order of severity.  By default,
+             severity {5, 4, 3, 2} and state {0, 1} are the only events that
+             will appear. keys limits the fields returned for every event and
+             records returns compact EventRecord objects instead of dicts.
+
+        '''
+        data = self.__event_query(device=device, limit=limit, component=component, severity=severity,
+                                  event_class=event_class, start=start, event_state=event_state, sort=sort,
+                                  direction=direction, keys=keys)
+        log.info('Getting events for %s', data)
+        events = self._request(
+            'EventsRouter', 'query', [data])['events']
+        if records:
+            return [EventRecord(event) for event in events]
+        return events
+
+    def iter_events(self, limit=None, records=False, **kwargs):
+        '''
+        yield events while the query response is still being downloaded
+
+        Takes the same arguments as get_events, only one event at a time is
+        decoded so memory use does not grow with the size of the response.
+
+        usage::
+            >>> for event in zen.iter_events(severity=[5], keys=['evid', 'device', 'summary']):
+            ...     print(event['summary'])
+        '''
+        data = self.__event_query(limit=limit, **kwargs)
+        log.info('Streaming events for %s', data)
+        for event in self._stream('EventsRouter', 'query', [data], 'events'):
+            yield EventRecord(event) if records else event
+
+    @staticmethod
+    def __event_query(device=None, limit=100, component=None, severity=None, event_class=None, # pylint: disable=R0913
+                      start=0, event_state=None, sort='severity', direction='DESC', keys=None):
+        '''Build the data of an EventsRouter query
+        '''
+        if severity is None:
+            severity = [5, 4, 3, 2]
+        if event_state is None:
+            event_state = [0, 1]
+        data = dict(start=start, limit=limit, dir=direction, sort=sort)
+        if keys:
+            data['keys'] = list(keys)
+        data['params'] = dict(severity=severity, eventState=event_state)
+        if device is not None:
+            data['params']['device'] = device
+        if component is not None:
+            data['params']['component'] = component
+        if event_class is not None:
+            data['params']['eventClass'] = event_class
+        return data
+
+    def aggregate_events(self, aggregator=None, batch_size=1000, **kwargs):
+        '''
+        stream events into an EventAggregator
+
+        Takes the same arguments as get_events, but defaults to every matching event.
+        Only the fields the aggregator needs are requested and events are added in
+        batches of batch_size while the response is read. Pass an existing
+        aggregator to add more events to it.
+
+        :return: the aggregator holding the events
+        :rtype: EventAggregator
+
+        usage::
+            >>> agg = zen.aggregate_events(severity=[5, 4])
+            >>> agg.top('device', 3)
+            [(u'web01', 412), (u'db02', 97), (u'sw01', 12)]
+        '''
+        aggregator = aggregator or EventAggregator()
+        kwargs.setdefault('keys', AGGREGATE_KEYS)
+        batch = list()
+        for event in self.iter_events(**kwargs):
+            batch.append(event)
+            if len(batch) >= batch_size:
+                aggregator.add(batch)
+                batch = list()
+        aggregator.add(batch)
+        return aggregator
+
+    def get_event_detail(self, event_id):
+        '''Find specific event details
+
+        '''
+        data = dict(evid=event_id)
+        return self._request('EventsRouter', 'detail', [data])
+
+    def write_log(self, event_id, message):
+        '''Write a message to the event's log
+
+        '''
+        data = dict(evid=event_id, message=message)
+        return self._request('EventsRouter', 'write_log', [data])
+
+    def change_event_state(self, event_id, state):
+        '''Change the state of an event.
+
+        '''
+        log.info('Changing eventState on %s to %s', event_id, state)
+        return self._request('EventsRouter', state, [{'evids': [event_id]}])
+
+    def ack_event(self, event_id):
+        '''Helper method to set the event state to acknowledged.
+
+        '''
+        return self.change_event_state(event_id, 'acknowledge')
+
+    def close_event(self, event_id):
+        '''Helper method to set the event state to closed.
+
+        '''
+        return self.change_event_state(event_id, 'close')
+
+    def create_event_on_device(self, device_name, severity, summary,
+                               component='', evclasskey='', evclass=''):
+        '''Manually create a new event for the device specified.
+            The device may be given as a name, uid, Device handle or device dict.
+
+        '''
+        log.info('Creating new event for %s with severity %s', device_name, severity)
+        if severity not in EVENT_SEVERITIES:
+            raise Exception('Severity %s is not valid.' % severity)
+        data = dict(device=_device_name(device_name), summary=summary, severity=severity,
+                    component=component, evclasskey=evclasskey, evclass=evclass)
+        return self._request('EventsRouter', 'add_event', [data])
+
+    def event_writer(self, batch_size=100, flush_interval=1.0, max_queue=10000, block=True):
+        '''
+        return an EventWriter that queues event writes and sends them in batches
+
+        :param batch_size: calls sent in one request
+        :type batch_size: int
+        :param flush_interval: seconds a queued call waits at most before it is sent
+        :type flush_interval: float
+        :param max_queue: calls queued at most before callers are held back
+        :type max_queue: int
+        :param block: wait for room when the queue is full instead of raising ZenossException
+        :type block: boolean
+        :return: a running writer, close it to send what is left
+        :rtype: EventWriter
+
+        usage::
+            >>> with zen.event_writer() as writer:
+            ...     future = writer.create_event_on_device('web01', 'Error', 'disk full')
+            >>> future.result()
+            {u'msg': u'Created event', u'success': True}
+        '''
+        return EventWriter(self._batch, batch_size=batch_size, flush_interval=flush_interval,
+                           max_queue=max_queue, block=block)
+
+
+class EventClassesRouterClient(RouterClient):
+    '''event classes and their transforms, available as Zenoss.event_classes_router'''
+    def add_event_class(self, name, description="", path=""):
+        '''
+        create a new event class
+
+        :param name: the endpoint name of the event class
+        :type name: string
+        :param description: description the new event class
+        :type description: string
+        :param path: path to where to put new event class
+        :type path: string
+        :return: zenoss success dict, with nodeConfig key showing the new event class details
+        :rtype: dict
+
+        usage::
+            >>> zen.add_event_class("Test", path="/Net", description="Testing")
+            {u'nodeConfig': {u'children': [],
+                 u'count': 0,
+                 u'hidden': False,
+                 u'iconCls': u'tree-severity-icon-small-clear',
+                 u'id': u'.zport.dmd.Events.Net.Testing',
+                 u'leaf': True,
+                 u'path': u'Events/Net/Test',
+                 u'text': {u'count': 0,
+                 u'description': u'Testing',
+                 u'hasTransform': False,
+                 u'text': u'Testing'},
+                 u'uid': u'/zport/dmd/Events/Net/Testing',
+                 u'uuid': u'...'},
+             u'success': True}
+        '''
+        base_org = "/zport/dmd/Events%s" % path
+        data = dict(contextUid=base_org, id=name, description=description, type="organizer")
+        result = self._request('EventClassesRouter', 'addNode', [data])
+        self._organizer_changed(base_org)
+        return result
 
     def get_ec_instance_details(self, name, path="", is_uid=False):
         '''
@@ -634,7 +2106,7 @@ class Zenoss(object):
             data = dict(uid=name)
         else:
             data = dict(uid="/zport/dmd/Events%s/instances/%s" % (path, name))
-        return self.__router_request('EventClassesRouter', 'getInstanceData', [data])
+        return self._request('EventClassesRouter', 'getInstanceData', [data])
 
     def get_event_classes_instances(self, path=""):
         '''
@@ -657,7 +2129,7 @@ class Zenoss(object):
         '''
         base_org = "/zport/dmd/Events%s" % path
         data = dict(params={}, uid=base_org)
-        return self.__router_request('EventClassesRouter', 'getInstances', [data])
+        return self._request('EventClassesRouter', 'getInstances', [data])
 
     def get_ec_instance_transform(self, name, path="", is_uid=False):
         '''
@@ -684,39 +2156,198 @@ class Zenoss(object):
         else:
             base_org = "/zport/dmd/Events%s" % path
             data = dict(uid="%s/instances/%s" % (base_org, name))
-        return self.__router_request('EventClassesRouter', 'getTransform', [data])
+        return self._request('EventClassesRouter', 'getTransform', [data])
 
-    def get_location_details(self, name, path=""):
+    def remove_event_class(self, name, path=""):
         '''
-        given a location return all the info about said location
+        remove an event class
 
-        :param name: location name
+        :param name: the endpoint name of the event class to be removed
         :type name: string
-        :param path: path to location
-        :return: dict of dict where data key has all the location details
+        :param path: path to where the event class is located
+        :type path: string
+        :return: zenoss success dict
         :rtype: dict
-        ::
-            >>> zen.get_location_details("DataCenter1")
-            {u'data': {u'address': u'742 Evergreen Terrace',
-              u'description': u'',
-              u'events': {u'clear': {u'acknowledged_count': 0, u'count': 0},
-               u'critical': {u'acknowledged_count': 0, u'count': 1},
-               u'debug': {u'acknowledged_count': 0, u'count': 0},
-               u'error': {u'acknowledged_count': 1, u'count': 7},
-               u'info': {u'acknowledged_count': 0, u'count': 82},
-               u'warning': {u'acknowledged_count': 0, u'count': 8}},
-              u'id': u'Europe',
-              u'inspector_type': u'Location',
-              u'meta_type': u'Location',
-              u'name': u'/DataCenter1',
-              u'severity': u'critical',
-              u'uid': u'/zport/dmd/Locations/DataCenter1',
-              u'uuid': u'...'},
-             u'disabled': False,
-             u'success': True}
+
+        usage::
+            >>> zen.remove_event_class("Testing", path="/Net")
+                {u'success': True}
         '''
-        uid = "/zport/dmd/Locations%s/%s" % (path, name)
-        return self.__router_request('DeviceRouter', 'getInfo', data=[dict(uid=uid)])
+        base_org = "/zport/dmd/Events%s" % path
+        data = dict(uid="%s/%s" % (base_org, name))
+        result = self._request('EventClassesRouter', 'deleteEventClass', [data])
+        self._organizer_changed(base_org)
+        return result
+
+    def set_ec_instance_details(self, name, transform, path="", is_uid=False):
+        '''
+        modify an event class details
+
+        :param name: name of the event class
+        :type name: string
+        :param transform: transform code
+        :type transform: string
+        :param path: path to even class
+        :type path: string
+        :param is_uid: is the name provided a uid, saves on look ups
+        :type is_uid: boolean
+        :return: zenoss success dict
+        :rtype: dict
+
+        usage::
+
+        '''
+        if is_uid:
+            data = dict(uid=name, transform=transform)
+        else:
+            base_org = "/zport/dmd/Events%s" % path
+            data = dict(uid="%s/instances/%s" % (base_org, name), transform=transform)
+        return self._request('EventClassesRouter', 'setTransform', [data])
+
+    def export_event_transforms(self, path="", workers=8):
+        '''
+        collect the transforms of every event class instance below a path
+
+        The event class tree is crawled one concurrent batch per level, then the
+        instances of every class are listed concurrently and only the instances
+        flagged with a transform are fetched.
+
+        :param path: event class path to start from, such as /Net
+        :type path: string
+        :param workers: number of requests to run at once
+        :type workers: int
+        :return: instance uid mapped to transform source
+        :rtype: dict
+
+        usage::
+            >>> zen.export_event_transforms("/Net/BGP")
+            {u'/zport/dmd/Events/Net/BGP/instances/bgpBackwardTransNotification': u'...event transform...'}
+        '''
+        tree = self._client.crawl_organizer_tree("/zport/dmd/Events%s" % path, workers=workers)
+        classes = [node['uid'] for node in tree.walk()]
+        listings = self._concurrently(
+            lambda uid: self._request('EventClassesRouter', 'getInstances', [dict(params={}, uid=uid)]),
+            classes, workers)
+        uids = sorted(set(instance['uid'] for listing in listings for instance in listing.get('data', [])
+                          if instance.get('hasTransform')))
+        log.info('Fetching %s transforms from %s event classes', len(uids), len(classes))
+        return self.__get_transforms(uids, workers)
+
+    def sync_event_transforms(self, transforms, dry_run=False, workers=8, batch_size=50):
+        '''
+        write event class instance transforms, touching only the ones that differ
+
+        Current transforms are fetched concurrently and compared by hash, ignoring
+        trailing whitespace and line ending style. The transforms that differ are
+        written with batches of setTransform calls, batch_size calls per request.
+
+        :param transforms: instance uid, or path below /zport/dmd/Events such as
+            /Net/BGP/instances/bgpNotify, mapped to the wanted transform source
+        :type transforms: dict
+        :param dry_run: only report what would change
+        :type dry_run: boolean
+        :return: list of changes, each a dict with uid, old and new hashes and a unified diff
+        :rtype: list
+
+        usage::
+            >>> zen.sync_event_transforms({'/Net/BGP/instances/bgpNotify': source}, dry_run=True)
+            [{'uid': '/zport/dmd/Events/Net/BGP/instances/bgpNotify', 'old': '3f2a...', 'new': '9c1e...',
+              'diff': '--- ...'}]
+        '''
+        wanted = dict((_organizer_uid(uid, '/zport/dmd/Events'), source) for uid, source in transforms.items())
+        current = self.__get_transforms(sorted(wanted), workers)
+        changes = list()
+        for uid in sorted(wanted):
+            old, new = _transform_hash(current.get(uid)), _transform_hash(wanted[uid])
+            if old != new:
+                import difflib
+                diff = ''.join(difflib.unified_diff((current.get(uid) or '').splitlines(True),
+                                                    (wanted[uid] or '').splitlines(True), uid, uid))
+                changes.append(dict(uid=uid, old=old, new=new, diff=diff))
+        log.info('%s of %s transforms differ', len(changes), len(wanted))
+        if dry_run or not changes:
+            return changes
+        batches = [changes[i:i + batch_size] for i in range(0, len(changes), batch_size)]
+        results = self._concurrently(
+            lambda batch: self._batch('EventClassesRouter', [
+                ('setTransform', [dict(uid=change['uid'], transform=wanted[change['uid']])]) for change in batch]),
+            batches, workers)
+        for batch, batch_results in zip(batches, results):
+            for change, result in zip(batch, batch_results):
+                change['result'] = result
+        return changes
+
+    def __get_transforms(self, uids, workers):
+        '''Fetch the transforms of instance uids concurrently, past the metadata cache as changes are looked for
+        '''
+        results = self._concurrently(
+            lambda uid: self._request('EventClassesRouter', 'getTransform', [dict(uid=uid)], cached=False),
+            uids, workers)
+        return dict((uid, result.get('data')) for uid, result in zip(uids, results))
+
+
+class TriggersRouterClient(RouterClient):
+    '''triggers and notifications, available as Zenoss.triggers_router'''
+    def add_notification(self, name, action):
+        '''
+        add a new notification
+
+        :param name: name of the notification
+        :type name: string
+        :param action: the notifications action
+        :type action: string
+        :return: zenoss success dict where the data key holds the whole notifications config details
+        :rtype: dict
+        usage::
+            >>> zen.add_notification("Testing", "email")
+            {u'data':
+                {u'action': u'email',
+                u'content': {...},
+                  ...
+                },
+            u'success': True}
+        '''
+        data = dict(newId=name, action=action)
+        return self._request('TriggersRouter', 'addNotification', [data])
+
+    def add_trigger(self, name, rules=None, users=None, enabled=True,
+                    global_manage=False, global_read=False, global_write=False):
+        '''
+        add a new trigger
+
+        :param name: name of new trigger
+        :type name: string
+        :param rule: event rule string
+        :type rule: string
+        :param users: list of dicts for user setting definitions
+        :type rule: list
+        :param enabled: is the trigger enabled
+        :type enabled: boolean
+        :param global_manage: is the trigger manageable by all, can it be deleted
+        :type global_manage: boolean
+        :param global_read: is the trigger readable by all, can it be seen
+        :type gloabl_read: boolean
+        :param global_write: is the trigger writable by all, can it be updated
+        :type global_write: boolean
+        :return: zenoss success dict
+        :rtype: dict
+
+
+        usage::
+            >>> zen.add_trigger('TEST')
+            {u'data': u'b0be2cf8-6182-4cc5-8b5c-545765869612', u'success': True}
+        '''
+        result = self._request('TriggersRouter', 'addTrigger', [dict(newId=name)])
+        if not result['success']:
+            raise ZenossException("Unable to add trigger %s Reason: %s" % (name, result['msg']))
+        if rules:
+            update_result = self.update_trigger_rules(name, rules, users=users, enabled=enabled,
+                                                      global_manage=global_manage,
+                                                      global_read=global_read,
+                                                      global_write=global_write)
+            if not update_result['success']:
+                raise ZenossException("Unable to update rules for trigger %s" % name)
+        return result
 
     def get_notifications(self):
         '''
@@ -735,7 +2366,7 @@ class Zenoss(object):
                 }]
             }
         '''
-        return self.__router_request('TriggersRouter', 'getNotifications', [{}])
+        return self._request('TriggersRouter', 'getNotifications', [{}])
 
     def get_triggers(self):
         '''
@@ -779,113 +2410,18 @@ class Zenoss(object):
             u'uuid': u'...'}],
         u'success': True}
         '''
-        return self.__router_request('TriggersRouter', 'getTriggers', [{}])
-
-    def get_zproperties(self, uid):
-        '''
-        take any uid to a zenoss object and return the zproperties for the object
-
-        :param uid: Specify the zenoss uid for object to inspect
-        :type uid: string
-        :return: zenoss response dict where data key holds all the properties
-        :rtype: dict
-        usage::
-            >>> zen.get_zproperties("/zport/dmd/Devices/Network")
-            {u'data': [ {
-                u'category': u'Modeler Controls',
-                u'description': u'Allows you to set the timeout time of the collector client in seconds',
-                u'id': u'zCollectorClientTimeout',
-                u'islocal': 0,
-                u'label': u'Collector Client Timeout (seconds)',
-                u'options': [],
-                u'path': u'/',
-                u'type': u'int',
-                u'value': 180,
-                u'valueAsString': 180},
-                ...
-                ]
-            u'success': True,
-            u'totalCount': 81
-        }
-        '''
-        return self.__router_request('PropertiesRouter', 'getZenProperties',
-                                     uri="%s%s/properties_router" % (self.__host, uid),
-                                     data=[dict(uid=uid)])
-
-    def remove_device_class(self, name, path=""):
-        '''
-        remove a given device class from zenoss
-
-        :param name: name of device class to be removed
-        :type name: string
-        :param path: path to device class endpoint
-        :type path: string
-        :return: dict showing the status of the command
-        :rtype: dict
-        usage::
-            >>> zen.remove_device_class("Switch", path="/Network")
-            {u'msg': u"Deleted node '/zport/dmd/Devices/HTTP/Test'", u'success': True}
-        '''
-        base_org = "/zport/dmd/Devices%s" % path
-        data = dict(uid="%s/%s" % (base_org, name))
-        return self.__router_request('DeviceRouter', 'deleteNode', [data])
-
-    def remove_event_class(self, name, path=""):
-        '''
-        remove an event class
-
-        :param name: the endpoint name of the event class to be removed
-        :type name: string
-        :param path: path to where the event class is located
-        :type path: string
-        :return: zenoss success dict
-        :rtype: dict
-
-        usage::
-            >>> zen.remove_event_class("Testing", path="/Net")
-                {u'success': True}
-        '''
-        base_org = "/zport/dmd/Events%s" % path
-        data = dict(uid="%s/%s" % (base_org, name))
-        return self.__router_request('EventClassesRouter', 'deleteEventClass', [data])
-
-    def remove_group(self, group, path=""):
-        '''
-        Deletes a Group organizer
-        :param group: name of group to be deleted
-        :type group: string
-        :param path: path to organizer holding group
-        :type path: string
-        :return: zenoss success dict
-        :rtype: dict
-
-        usage::
-            >>> zen.remove_group("MyGroup")
-            {u'msg': u"Deleted node '/zport/dmd/Groups/MyGroup'", u'success': True}
-        '''
-        base_org = "/zport/dmd/Groups%s" % path
-        log.info('Removing Group %s', group)
-        data = dict(uid="%s/%s" % (base_org, group))
-        return self.__router_request('DeviceRouter', 'deleteNode', [data])
+        return self._request('TriggersRouter', 'getTriggers', [{}])
 
-    def remove_locations(self, location, path=""):
+    def trigger_engine(self):
         '''
-        Deletes a Location organizer
+        return a TriggerRuleEngine holding the enabled triggers of the server
 
-        :param location: name of the location to be remove
-        :type location: string
-        :param path: path to the location organizer
-        :type path: string
-        :return: zenoss success dict
-        :rtype: dict
         usage::
-            >>> zen.remove_locations("Springfield")
-            {u'msg': u"Deleted node '/zport/dmd/Locations/Springfield'", u'success': True}
+            >>> engine = zen.trigger_engine()
+            >>> engine.evaluate(zen.get_events(limit=None), zen.get_devices()['devices'])
+            [({...event...}, [u'RuleName']), ...]
         '''
-        base_org = "/zport/dmd/Locations%s" % path
-        log.info('Removing Location %s', location)
-        data = dict(uid="%s/%s" % (base_org, location))
-        return self.__router_request('DeviceRouter', 'deleteNode', [data])
+        return TriggerRuleEngine(self.get_triggers()['data'])
 
     def remove_trigger(self, name):
         '''
@@ -905,32 +2441,7 @@ class Zenoss(object):
         if name not in all_triggers:
             raise ZenossException("Unable to find trigger %s" % (name))
         uuid = all_triggers[name]['uuid']
-        return self.__router_request('TriggersRouter', 'removeTrigger', [dict(uuid=uuid)])
-
-    def set_ec_instance_details(self, name, transform, path="", is_uid=False):
-        '''
-        modify an event class details
-
-        :param name: name of the event class
-        :type name: string
-        :param transform: transform code
-        :type transform: string
-        :param path: path to even class
-        :type path: string
-        :param is_uid: is the name provided a uid, saves on look ups
-        :type is_uid: boolean
-        :return: zenoss success dict
-        :rtype: dict
-
-        usage::
-
-        '''
-        if is_uid:
-            data = dict(uid=name, transform=transform)
-        else:
-            base_org = "/zport/dmd/Events%s" % path
-            data = dict(uid="%s/instances/%s" % (base_org, name))
-        return self.__router_request('EventClassesRouter', 'setTransform', [data])
+        return self._request('TriggersRouter', 'removeTrigger', [dict(uuid=uuid)])
 
     def update_notifiication_sub(self, name, subscriptions, by_name=False):
         '''
@@ -974,7 +2485,7 @@ class Zenoss(object):
                 raise ZenossException("Passed trigger subscription uuid that doesn't exist %s" % diff)
         data = all_notifications[name]
         data['subscriptions'] = subscriptions
-        return self.__router_request('TriggersRouter', 'updateNotification', [data])
+        return self._request('TriggersRouter', 'updateNotification', [data])
 
     def update_trigger_rules(self, name, rule=None, users=None, enabled=True,
                              global_manage=False, global_read=False, global_write=False):
@@ -1024,4 +2535,1229 @@ class Zenoss(object):
         )
         if users:
             data['users'] = users
-        return self.__router_request('TriggersRouter', 'updateTrigger', [data])
+        return self._request('TriggersRouter', 'updateTrigger', [data])
+
+
+class PropertiesRouterClient(RouterClient):
+    '''zProperties, available as Zenoss.properties_router'''
+    def __init__(self, *args):
+        super(PropertiesRouterClient, self).__init__(*args)
+        self.__zproperties = dict()
+        self.__overrides = dict()
+        self.__zproperties_lock = threading.Lock()
+
+    def get_zproperties(self, uid):
+        '''
+        take any uid to a zenoss object and return the zproperties for the object
+
+        :param uid: Specify the zenoss uid for object to inspect
+        :type uid: string
+        :return: zenoss response dict where data key holds all the properties
+        :rtype: dict
+        usage::
+            >>> zen.get_zproperties("/zport/dmd/Devices/Network")
+            {u'data': [ {
+                u'category': u'Modeler Controls',
+                u'description': u'Allows you to set the timeout time of the collector client in seconds',
+                u'id': u'zCollectorClientTimeout',
+                u'islocal': 0,
+                u'label': u'Collector Client Timeout (seconds)',
+                u'options': [],
+                u'path': u'/',
+                u'type': u'int',
+                u'value': 180,
+                u'valueAsString': 180},
+                ...
+                ]
+            u'success': True,
+            u'totalCount': 81
+        }
+        '''
+        return self._request('PropertiesRouter', 'getZenProperties',
+                                     uri="%s%s/properties_router" % (self._host, uid),
+                                     data=[dict(uid=uid)])
+
+    def get_zproperty_values(self, uids, zproperties, local_overrides=(), ttl=300, workers=8, # pylint: disable=R0913
+                             detect_overrides=True, details=False):
+        '''
+        return the effective value of zProperties for many objects at once
+
+        A device inherits its zProperties from its device class, so the full property
+        dump is fetched once per distinct organizer and shared by every device in it.
+        Devices the server lists as overriding one of the zProperties below those
+        organizers, uids listed in local_overrides, and organizers themselves get a
+        fetch of their own. Dumps are cached for ttl seconds and reused by later calls.
+
+        :param uids: device or organizer uids
+        :type uids: list
+        :param zproperties: zProperty id or list of ids to resolve
+        :type zproperties: list
+        :param local_overrides: uids known to set some of the zProperties locally
+        :type local_overrides: list
+        :param ttl: seconds a fetched property dump stays valid
+        :type ttl: int
+        :param detect_overrides: ask the server which devices override the zProperties
+        :type detect_overrides: boolean
+        :param details: return dicts with value, path, islocal and inherited in place of bare values,
+            inherited is True when the value was taken from an organizer
+        :type details: boolean
+        :return: uid mapped to a dict of zProperty id to effective value
+        :rtype: dict
+
+        usage::
+            >>> zen.get_zproperty_values(uids, 'zSnmpCommunity', details=True)
+            {u'/zport/dmd/Devices/Server/Linux/devices/web01': {'zSnmpCommunity': {
+                'value': u'public', 'path': u'/', 'islocal': False, 'inherited': True}}, ...}
+        '''
+        if not isinstance(zproperties, (list, tuple, set)):
+            zproperties = [zproperties]
+        local_overrides = set(local_overrides)
+        if detect_overrides:
+            organizers = sorted(set(_uid_organizer(uid) for uid in uids if '/devices/' in uid))
+            local_overrides.update(self.__zproperty_overrides(organizers, zproperties, ttl, workers))
+        owners = dict()
+        for uid in uids:
+            if uid in local_overrides or '/devices/' not in uid:
+                owners[uid] = uid
+            else:
+                owners[uid] = _uid_organizer(uid)
+        now = time.time()
+        with self.__zproperties_lock:
+            stale = sorted(set(owner for owner in owners.values()
+                               if owner not in self.__zproperties or now - self.__zproperties[owner][0] > ttl))
+        log.info('Fetching zProperties of %s objects for %s uids', len(stale), len(owners))
+        dumps = self._concurrently(self.get_zproperties, stale, workers)
+        with self.__zproperties_lock:
+            for owner, dump in zip(stale, dumps):
+                self.__zproperties[owner] = (now, dict((prop['id'], prop) for prop in dump.get('data', [])))
+            dumps = dict((owner, self.__zproperties[owner][1]) for owner in set(owners.values()))
+        result = dict()
+        for uid, owner in owners.items():
+            props = dumps[owner]
+            values = result[uid] = dict()
+            for name in zproperties:
+                prop = props.get(name) or dict()
+                if not details:
+                    values[name] = prop.get('value')
+                    continue
+                islocal = owner == uid and bool(prop.get('islocal'))
+                values[name] = dict(value=prop.get('value'), path=prop.get('path'), islocal=islocal,
+                                    inherited=not islocal)
+        return result
+
+    def __zproperty_overrides(self, organizers, zproperties, ttl, workers):
+        '''Return the devices below organizers that set one of zproperties locally, cached for ttl seconds.
+            When the server cannot tell, the devices keep the values of their organizer.
+        '''
+        pairs = [(organizer, name) for organizer in organizers for name in zproperties]
+        now = time.time()
+        with self.__zproperties_lock:
+            stale = [pair for pair in pairs if pair not in self.__overrides
+                     or now - self.__overrides[pair][0] > ttl]
+
+        def overridden(pair):
+            '''List the objects overriding one zProperty below one organizer'''
+            organizer, name = pair
+            try:
+                listing = self._request('PropertiesRouter', 'getOverriddenObjectsList',
+                                                uri="%s%s/properties_router" % (self._host, organizer),
+                                                data=[dict(uid=organizer, propname=name, relName='devices')])
+                if listing.get('success') is False:
+                    raise ZenossException(listing.get('msg') or 'Request failed')
+                return listing
+            except Exception as ex: # pylint: disable=W0703
+                log.warning('Cannot list overrides of %s below %s, its devices get inherited values: %s',
+                            name, organizer, ex)
+                return None
+        found = self._concurrently(overridden, stale, workers)
+        with self.__zproperties_lock:
+            for pair, listing in zip(stale, found):
+                if listing is not None:
+                    uids = set(item.get('uid') for item in listing.get('data') or [] if isinstance(item, dict))
+                    self.__overrides[pair] = (now, set(uid for uid in uids if uid and '/devices/' in uid))
+            return set(uid for pair in pairs if pair in self.__overrides for uid in self.__overrides[pair][1])
+
+
+ROUTER_CLIENTS = {'DeviceRouter': DeviceRouterClient,
+                  'EventsRouter': EventsRouterClient,
+                  'EventClassesRouter': EventClassesRouterClient,
+                  'TriggersRouter': TriggersRouterClient,
+                  'PropertiesRouter': PropertiesRouterClient}
+
+
+def _delegate(attribute, method):
+    '''Make a Zenoss method that calls the same method of the router client held in attribute'''
+    def call(self, *args, **kwargs):
+        return getattr(getattr(self, attribute), method.__name__)(*args, **kwargs)
+    call.__name__ = method.__name__
+    call.__doc__ = method.__doc__
+    return call
+
+
+for _attribute, _router in ROUTER_ATTRIBUTES.items():
+    if _router in ROUTER_CLIENTS:
+        for _name, _method in vars(ROUTER_CLIENTS[_router]).items():
+            if not _name.startswith('_') and callable(_method):
+                setattr(Zenoss, _name, _delegate(_attribute, _method))
+
+
+class Device(object):
+    '''
+    handle to a device that was looked up once
+
+    Created by Zenoss.device. The attributes found by the lookup are available as
+    items, and the handle can be passed to any name based method of Zenoss.
+    '''
+    def __init__(self, client, attributes):
+        self.client = client
+        self.attributes = attributes
+
+    def __getitem__(self, key):
+        return self.attributes[key]
+
+    def __contains__(self, key):
+        return key in self.attributes
+
+    def __repr__(self):
+        return 'Device(%r)' % self.attributes.get('name')
+
+    def get(self, key, default=None):
+        '''Dict style get on the device attributes'''
+        return self.attributes.get(key, default)
+
+    @property
+    def name(self):
+        '''Device name'''
+        return self.attributes['name']
+
+    @property
+    def uid(self):
+        '''Device uid'''
+        return self.attributes['uid']
+
+    def refresh(self, keys=None):
+        '''Look the device up again'''
+        self.attributes = self.client.find_device(self.name, keys=keys)
+        return self
+
+    def remove(self):
+        '''See Zenoss.remove_device'''
+        return self.client.remove_device(self)
+
+    def move(self, organizer):
+        '''See Zenoss.move_device, the handle follows the device to its new uid'''
+        result = self.client.move_device(self, organizer)
+        if organizer.startswith('/zport/dmd/Devices'):
+            self.attributes['uid'] = '%s/devices/%s' % (organizer.rstrip('/'), self.uid.rsplit('/', 1)[-1])
+        return result
+
+    def rename(self, new_name):
+        '''See Zenoss.rename_device, the handle follows the device to its new uid'''
+        result = self.client.rename_device(self, new_name)
+        self.attributes['uid'] = '%s/%s' % (self.uid.rsplit('/', 1)[0], new_name)
+        self.attributes['name'] = new_name
+        return result
+
+    def set_prod_state(self, prod_state):
+        '''See Zenoss.set_prod_state'''
+        return self.client.set_prod_state(self, prod_state)
+
+    def set_maintenance(self):
+        '''See Zenoss.set_maintenance'''
+        return self.client.set_maintenance(self)
+
+    def set_production(self):
+        '''See Zenoss.set_production'''
+        return self.client.set_production(self)
+
+    def set_product_info(self, hw_manufacturer, hw_product_name, os_manufacturer, os_product_name):
+        '''See Zenoss.set_product_info'''
+        return self.client.set_product_info(self, hw_manufacturer, hw_product_name, os_manufacturer,
+                                            os_product_name)
+
+    def set_rhel_release(self, release):
+        '''See Zenoss.set_rhel_release'''
+        return self.client.set_rhel_release(self, release)
+
+    def set_info(self, data):
+        '''See Zenoss.set_device_info'''
+        return self.client.set_device_info(self, data)
+
+    def set_collector(self, collector):
+        '''See Zenoss.set_collector'''
+        return self.client.set_collector(self, collector)
+
+    def reset_ip(self, ip_address=''):
+        '''See Zenoss.reset_ip'''
+        return self.client.reset_ip(self, ip_address)
+
+    def remodel(self):
+        '''See Zenoss.remodel_device'''
+        return self.client.remodel_device(self)
+
+    def get_components(self, **kwargs):
+        '''See Zenoss.get_components_by_uid'''
+        return self.client.get_components_by_uid(uid=self.uid, **kwargs)
+
+    def get_rrd_values(self, dsnames, start=None, end=None, function='LAST'):
+        '''See Zenoss.get_rrd_values'''
+        return self.client.get_rrd_values(self, dsnames, start=start, end=end, function=function)
+
+    def get_load_average(self):
+        '''See Zenoss.get_load_average'''
+        return self.client.get_load_average(self)
+
+
+class InventoryIndex(object):
+    '''
+    local multi key search index over device dicts
+
+    Names are kept in a sorted list so prefix lookups are a binary search, IPv4
+    and IPv6 addresses in sorted numeric lists so a CIDR lookup is a range, and
+    device class, location, group and system uids in sorted lists of organizer
+    uids so a whole subtree is one range as well. Devices can be added and
+    removed one at a time.
+    '''
+    def __init__(self, devices=()):
+        # Later devices replace earlier ones with the same uid, then every list is sorted once
+        self.__devices = dict((device['uid'], device) for device in devices)
+        self.__names = list()
+        self.__ips = list()
+        self.__organizers = list()
+        for device in self.__devices.values():
+            names, ips, organizers = self.__entries(device)
+            self.__names.extend(names)
+            self.__ips.extend(ips)
+            self.__organizers.extend(organizers)
+        self.__names.sort()
+        self.__ips.sort()
+        self.__organizers.sort()
+
+    def __len__(self):
+        return len(self.__devices)
+
+    def __contains__(self, uid):
+        return uid in self.__devices
+
+    @staticmethod
+    def __ip(device):
+        '''Numeric ip of a device as a (version, int) tuple, or None'''
+        address = device.get('ipAddressString') or device.get('ipAddress')
+        if not address:
+            return None
+        import ipaddress
+        try:
+            ip = ipaddress.ip_address(address if not isinstance(address, bytes) else address.decode('ascii'))
+        except ValueError:
+            return None
+        return (ip.version, int(ip))
+
+    @staticmethod
+    def __organizer_uids(device):
+        '''Every organizer uid a device belongs to'''
+        uids = [_uid_organizer(device['uid'])]
+        for attr, root in (('location', '/zport/dmd/Locations'), ('groups', '/zport/dmd/Groups'),
+                           ('systems', '/zport/dmd/Systems')):
+            refs = device.get(attr) or []
+            for ref in refs if isinstance(refs, list) else [refs]:
+                if isinstance(ref, dict):
+                    ref = ref.get('uid') or _organizer_uid(ref.get('name') or '', root)
+                if ref:
+                    uids.append(_organizer_uid(ref, root))
+        return uids
+
+    def __entries(self, device):
+        '''The name, ip and organizer entries of a device'''
+        uid = device['uid']
+        ip = self.__ip(device)
+        return ([(device['name'].lower(), uid)], [(ip, uid)] if ip else [],
+                [(organizer + '/', uid) for organizer in self.__organizer_uids(device)])
+
+    def add(self, device):
+        '''Index a device dict, replacing any device with the same uid'''
+        if device['uid'] in self.__devices:
+            self.remove(device['uid'])
+        self.__devices[device['uid']] = device
+        for items, entries in zip((self.__names, self.__ips, self.__organizers), self.__entries(device)):
+            for entry in entries:
+                insort(items, entry)
+
+    def remove(self, uid):
+        '''Drop a device from the index, unknown uids are ignored'''
+        device = self.__devices.pop(uid, None)
+        if device is None:
+            return
+        for items, entries in zip((self.__names, self.__ips, self.__organizers), self.__entries(device)):
+            for entry in entries:
+                _sorted_remove(items, entry)
+
+    def get(self, uid):
+        '''Return the device with a uid, or None'''
+        return self.__devices.get(uid)
+
+    def __range(self, items, low, high):
+        '''Devices of the entries of a sorted list of (key, uid) tuples with low <= key < high'''
+        start = bisect_left(items, (low,))
+        end = bisect_left(items, (high,))
+        return [self.__devices[uid] for _, uid in items[start:end]]
+
+    def by_name(self, name):
+        '''Devices named exactly name, ignoring case'''
+        return self.__range(self.__names, name.lower(), name.lower() + '\x00')
+
+    def by_prefix(self, prefix):
+        '''Devices whose name starts with prefix, ignoring case'''
+        prefix = prefix.lower()
+        return self.__range(self.__names, prefix, prefix + u'\U0010ffff')
+
+    def by_regex(self, pattern):
+        '''Devices whose name matches a regular expression'''
+        match = re.compile(pattern).search
+        return [device for device in self.__devices.values() if match(device['name'])]
+
+    def by_ip(self, address):
+        '''Devices with an ip address'''
+        return self.by_cidr(address)
+
+    def by_cidr(self, cidr):
+        '''Devices with an ip address inside a network such as 10.1.0.0/16'''
+        import ipaddress
+        network = ipaddress.ip_network(cidr if not isinstance(cidr, bytes) else cidr.decode('ascii'),
+                                       strict=False)
+        low = int(network.network_address)
+        return self.__range(self.__ips, (network.version, low), (network.version, low + network.num_addresses))
+
+    def by_organizer(self, uid, subtree=True):
+        '''Devices in an organizer uid, including every organizer below it unless subtree is False'''
+        uid = uid.rstrip('/') + '/'
+        if subtree:
+            return self.__range(self.__organizers, uid, uid[:-1] + '0')
+        return self.__range(self.__organizers, uid, uid + '\x00')
+
+    def by_device_class(self, path, subtree=True):
+        '''Devices in a device class such as /Server/Linux'''
+        return self.by_organizer(_organizer_uid(path, '/zport/dmd/Devices'), subtree)
+
+    def by_location(self, path, subtree=True):
+        '''Devices in a location such as /DataCenter1'''
+        return self.by_organizer(_organizer_uid(path, '/zport/dmd/Locations'), subtree)
+
+    def by_group(self, path, subtree=True):
+        '''Devices in a group such as /Web'''
+        return self.by_organizer(_organizer_uid(path, '/zport/dmd/Groups'), subtree)
+
+
+def _numpy():
+    '''Return numpy when it is installed, None otherwise'''
+    try:
+        import numpy # pylint: disable=F0401
+    except ImportError:
+        return None
+    return numpy
+
+
+def _event_timestamp(value):
+    '''Turn an event time, epoch seconds or a formatted date, into epoch seconds'''
+    if value is None or value == '':
+        return float('nan')
+    if isinstance(value, (int, float)):
+        # Zenoss sends epoch milliseconds in some versions
+        return value / 1000.0 if value > 1e11 else float(value)
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y/%m/%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S'):
+        try:
+            return time.mktime(time.strptime(value.split('.')[0], fmt))
+        except ValueError:
+            continue
+    return float('nan')
+
+
+class EventAggregator(object):
+    '''
+    column store of events for fast group by counts and time histograms
+
+    Each event becomes one entry in typed arrays: severity, an integer id per
+    device, event class and component, the last occurrence time and the
+    occurrence count. Counting is done over the whole columns at once, with
+    numpy when it is installed. Events can be added at any time.
+    '''
+    FIELDS = ('device', 'eventClass', 'component')
+
+    def __init__(self):
+        self.severity = array('b')
+        self.last_time = array('d')
+        self.count = array('l')
+        self.__ids = dict((field, array('l')) for field in self.FIELDS)
+        self.__values = dict((field, list()) for field in self.FIELDS)
+        self.__lookup = dict((field, dict()) for field in self.FIELDS)
+
+    def __len__(self):
+        return len(self.severity)
+
+    def add(self, events):
+        '''Append events, dicts or EventRecords from the EventsRouter query'''
+        for event in events:
+            self.severity.append(int(event.get('severity') or 0))
+            self.last_time.append(_event_timestamp(event.get('lastTime')))
+            self.count.append(int(event.get('count') or 1))
+            for field in self.FIELDS:
+                value = event.get(field)
+                if isinstance(value, dict):
+                    value = value.get('text') or value.get('uid')
+                lookup = self.__lookup[field]
+                if value not in lookup:
+                    lookup[value] = len(self.__values[field])
+                    self.__values[field].append(value)
+                self.__ids[field].append(lookup[value])
+
+    def __column(self, field):
+        '''Return the integer column and the values its ids stand for'''
+        if field == 'severity':
+            return self.severity, None
+        if field not in self.__ids:
+            raise ZenossException('Cannot aggregate events by %s' % field)
+        return self.__ids[field], self.__values[field]
+
+    def counts_by(self, field, weighted=False):
+        '''
+        count events per value of severity, device, eventClass or component
+
+        :param weighted: count occurrences, the count field of each event, instead of events
+        :type weighted: boolean
+        :return: value mapped to count
+        :rtype: dict
+        '''
+        column, values = self.__column(field)
+        numpy = _numpy()
+        if numpy is not None and len(column):
+            ids = numpy.frombuffer(column, dtype=numpy.dtype(column.typecode))
+            weights = numpy.frombuffer(self.count, dtype=numpy.dtype(self.count.typecode)) if weighted else None
+            offset = int(ids.min())
+            totals = numpy.bincount(ids - offset, weights=weights)
+            counts = dict((int(i) + offset, int(totals[i])) for i in numpy.flatnonzero(totals))
+        elif weighted:
+            counts = Counter()
+            for key, weight in zip(column, self.count):
+                counts[key] += weight
+        else:
+            counts = Counter(column)
+        if values is None:
+            return dict(counts)
+        return dict((values[key], total) for key, total in counts.items())
+
+    def top(self, field='device', limit=10, weighted=False):
+        '''Return the limit values of field with the most events as (value, count) tuples'''
+        counts = self.counts_by(field, weighted)
+        return sorted(counts.items(), key=lambda item: (-item[1], str(item[0])))[:limit]
+
+    def histogram(self, bucket_seconds=300, by=None):
+        '''
+        count events per time bucket of their last occurrence
+
+        :param bucket_seconds: width of a bucket
+        :type bucket_seconds: int
+        :param by: also split every bucket by severity, device, eventClass or component
+        :type by: string
+        :return: bucket start time mapped to a count, or to a dict of value to count
+        :rtype: dict
+        '''
+        numpy = _numpy()
+        column, values = self.__column(by) if by else (None, None)
+        if numpy is not None and len(self):
+            times = numpy.frombuffer(self.last_time, dtype=numpy.float64)
+            known = ~numpy.isnan(times)
+            buckets = (times[known] // bucket_seconds).astype(numpy.int64) * bucket_seconds
+            if column is None:
+                keys, totals = numpy.unique(buckets, return_counts=True)
+                return dict((int(k), int(t)) for k, t in zip(keys, totals))
+            ids = numpy.frombuffer(column, dtype=numpy.dtype(column.typecode))[known]
+            pairs, totals = numpy.unique(numpy.stack([buckets, ids.astype(numpy.int64)], axis=1),
+                                         axis=0, return_counts=True)
+            counts = Counter(dict(((int(b), int(i)), int(t)) for (b, i), t in zip(pairs, totals)))
+        else:
+            starts = [int(t // bucket_seconds) * bucket_seconds if t == t else None for t in self.last_time]
+            if column is None:
+                counts = Counter(start for start in starts if start is not None)
+                return dict(counts)
+            counts = Counter((start, key) for start, key in zip(starts, column) if start is not None)
+        result = dict()
+        for (start, key), total in counts.items():
+            result.setdefault(start, dict())[values[key] if values is not None else key] = total
+        return result
+
+
+# EventsRouter query fields behind the evt attributes of a trigger rule
+_EVT_FIELDS = {'severity': 'severity', 'summary': 'summary', 'message': 'message', 'event_class': 'eventClass',
+               'event_key': 'eventKey', 'event_class_key': 'eventClassKey', 'agent': 'agent',
+               'monitor': 'monitor', 'count': 'count', 'fingerprint': 'dedupid', 'status': 'eventState',
+               'current_user_name': 'ownerid', 'event_group': 'eventGroup'}
+_EVENT_STATES = {'New': 0, 'Acknowledged': 1, 'Suppressed': 2, 'Closed': 3, 'Cleared': 4, 'Dropped': 5,
+                 'Aged': 6}
+
+
+def _rule_text(value):
+    '''Reduce a reference dict, or a list of them, to the names a rule compares against'''
+    if isinstance(value, list):
+        return tuple(_rule_text(item) for item in value)
+    if isinstance(value, dict):
+        return value.get('text') or value.get('name') or value.get('path') or value.get('uid')
+    return value
+
+
+class _RuleObject(object):
+    '''Attribute access to the values of a rule variable, unknown attributes are None'''
+    def __init__(self, values):
+        self.__dict__.update(values)
+
+    def __getattr__(self, name):
+        return None
+
+
+class TriggerRuleEngine(object):
+    '''
+    evaluates trigger rules locally against events and devices
+
+    Rule sources are parsed once, checked against a small whitelist of Python
+    syntax (boolean logic, comparisons, membership and a few string methods on
+    the evt, dev, elem and sub_elem variables) and compiled to cached code
+    objects. A rule that fails to evaluate for an event counts as not firing.
+
+    :param triggers: triggers as returned in the data key of Zenoss.get_triggers
+    :type triggers: list
+    :param include_disabled: also evaluate disabled triggers
+    :type include_disabled: boolean
+    '''
+    def __init__(self, triggers=(), include_disabled=False):
+        self.__compiled = dict()
+        self.triggers = list()
+        for trigger in triggers:
+            if trigger.get('enabled', True) or include_disabled:
+                source = trigger['rule']['source'] if isinstance(trigger.get('rule'), dict) else trigger['rule']
+                self.triggers.append((trigger['name'], self.compile(source)))
+
+    def compile(self, source):
+        '''Return the code object for a rule source, raising ZenossException for disallowed syntax'''
+        if source in self.__compiled:
+            return self.__compiled[source]
+        import ast
+        try:
+            tree = ast.parse(source.strip() or 'True', mode='eval')
+        except SyntaxError as ex:
+            raise ZenossException('Invalid trigger rule %r: %s' % (source, ex))
+        for node in ast.walk(tree):
+            kind = type(node).__name__
+            if kind not in TRIGGER_RULE_NODES:
+                raise ZenossException('%s is not allowed in trigger rules' % kind)
+            if kind == 'Name' and node.id not in TRIGGER_RULE_NAMES:
+                raise ZenossException('Unknown name %s in trigger rule' % node.id)
+            if kind == 'Attribute' and node.attr.startswith('_'):
+                raise ZenossException('Private attribute %s in trigger rule' % node.attr)
+            if kind == 'Call' and not (isinstance(node.func, ast.Attribute) and
+                                       node.func.attr in TRIGGER_RULE_CALLS):
+                raise ZenossException('Only string methods may be called in trigger rules')
+        code = self.__compiled[source] = compile(tree, '<trigger rule>', 'eval')
+        return code
+
+    @staticmethod
+    def context(event, device=None):
+        '''Build the evt, dev, elem and sub_elem variables of a rule for an event and its device'''
+        evt = dict((attr, _rule_text(event.get(field))) for attr, field in _EVT_FIELDS.items())
+        evt['status'] = _EVENT_STATES.get(evt['status'], evt['status'])
+        dev = dict(name=_rule_text(event.get('device')),
+                   production_state=event.get('prodState'),
+                   priority=event.get('DevicePriority'),
+                   device_class=_rule_text(event.get('DeviceClass')),
+                   location=_rule_text(event.get('Location')),
+                   groups=_rule_text(event.get('DeviceGroups')),
+                   systems=_rule_text(event.get('Systems')),
+                   ip_address=event.get('ipAddress'))
+        for key in ('device_class', 'location'):
+            if isinstance(dev[key], tuple):
+                dev[key] = dev[key][0] if dev[key] else None
+        if device is not None:
+            dev.update(name=device.get('name'),
+                       production_state=device.get('productionState'),
+                       priority=device.get('priority'),
+                       device_class=_uid_organizer(device['uid'])[len('/zport/dmd/Devices'):] or '/',
+                       location=_rule_text(device.get('location')),
+                       groups=_rule_text(device.get('groups')) or (),
+                       systems=_rule_text(device.get('systems')) or (),
+                       ip_address=device.get('ipAddressString'))
+        return dict(evt=_RuleObject(evt), dev=_RuleObject(dev),
+                    elem=_RuleObject(dict(name=dev['name'], type='DEVICE')),
+                    sub_elem=_RuleObject(dict(name=_rule_text(event.get('component')), type='COMPONENT')))
+
+    def matches(self, event, device=None):
+        '''Return the names of the triggers that fire for an event'''
+        scope = self.context(event, device)
+        fired = list()
+        for name, code in self.triggers:
+            try:
+                if eval(code, {'__builtins__': {}}, scope): # pylint: disable=W0123
+                    fired.append(name)
+            except Exception: # pylint: disable=W0703
+                continue
+        return fired
+
+    def evaluate(self, events, devices=()):
+        '''
+        evaluate every trigger against events
+
+        :param events: events from Zenoss.get_events
+        :type events: list
+        :param devices: devices from Zenoss.get_devices, matched to events by uid or name
+        :type devices: list
+        :return: (event, names of the triggers that fired) for every event
+        :rtype: list
+        '''
+        by_key = dict()
+        for device in devices:
+            by_key[device.get('uid')] = by_key[device.get('name')] = device
+        results = list()
+        for event in events:
+            ref = event.get('device')
+            device = by_key.get(ref.get('uid')) or by_key.get(ref.get('text')) if isinstance(ref, dict) \
+                else by_key.get(ref)
+            results.append((event, self.matches(event, device)))
+        return results
+
+
+def _sorted_remove(items, item):
+    '''Remove item from a sorted list'''
+    i = bisect_left(items, item)
+    if i < len(items) and items[i] == item:
+        del items[i]
+
+
+def metadata_category(router, method, data):
+    '''
+    return the MetadataCache category a router call reads or changes, or None
+
+    Calls are sorted by the organizer uid they work on; any EventClassesRouter
+    call touches event classes.
+    '''
+    if router == 'EventClassesRouter':
+        return 'event_classes'
+    if router != 'DeviceRouter' or method in ('getDevices', 'getComponents'):
+        return None
+    args = data[0] if isinstance(data, list) and data else data
+    if isinstance(args, dict):
+        uid = args.get('uid') or args.get('contextUid') or args.get('id')
+    else:
+        uid = args
+    if not hasattr(uid, 'startswith'):
+        return None
+    if method == 'getTemplates' or '/rrdTemplates' in uid:
+        return 'templates'
+    for prefix, category in (('/zport/dmd/Devices', 'device_classes'), ('/zport/dmd/Locations', 'locations'),
+                             ('/zport/dmd/Groups', 'groups')):
+        if uid.startswith(prefix) and '/devices/' not in uid:
+            return category
+    return None
+
+
+class MetadataCache(object):
+    '''
+    on disk cache for slow changing configuration, shared by every process using the same directory
+
+    Results are kept per host and category as one JSON file each. Files are written
+    to a temporary name and renamed into place, so readers never see partial
+    entries. Writes made through a client invalidate the whole category, and the
+    oldest entries are removed once the cache grows beyond max_bytes.
+
+    :param directory: where to keep the cache
+    :type directory: string
+    :param ttls: category mapped to seconds entries stay valid, defaults to METADATA_TTLS
+    :type ttls: dict
+    :param max_bytes: size the cache is trimmed back to
+    :type max_bytes: int
+
+    usage::
+        >>> cache = MetadataCache(os.path.expanduser('~/.cache/zenoss'))
+        >>> zen = Zenoss('http://zenoss:8080/', 'admin', 'password', metadata_cache=cache)
+    '''
+    def __init__(self, directory, ttls=None, max_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.ttls = dict(METADATA_TTLS)
+        self.ttls.update(ttls or {})
+        self.max_bytes = max_bytes
+        self.__puts = itertools.count(1)
+
+    def __category_dir(self, host, category):
+        '''Directory holding a category of a host'''
+        import hashlib
+        return os.path.join(self.directory, hashlib.sha1(host.encode('utf-8')).hexdigest()[:16], category)
+
+    def __invalidated(self, folder):
+        '''Time the category was last invalidated'''
+        try:
+            return os.path.getmtime(os.path.join(folder, '.invalidated'))
+        except OSError:
+            return 0
+
+    @staticmethod
+    def __name(key):
+        '''File name for a key'''
+        import hashlib
+        return hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest() + '.json'
+
+    def get(self, host, category, key):
+        '''Return (True, result) for a valid entry and (False, None) otherwise'''
+        folder = self.__category_dir(host, category)
+        try:
+            with open(os.path.join(folder, self.__name(key))) as entry:
+                stored = json.load(entry)
+        except (IOError, OSError, ValueError):
+            return False, None
+        if stored['key'] != json.loads(json.dumps(key)) or \
+                time.time() - stored['stored'] > self.ttls.get(category, 0) or \
+                stored['stored'] < self.__invalidated(folder):
+            return False, None
+        return True, stored['result']
+
+    def put(self, host, category, key, result, fetched=None):
+        '''Store a result fetched at time fetched, unless the category was invalidated since'''
+        folder = self.__category_dir(host, category)
+        fetched = fetched or time.time()
+        if fetched < self.__invalidated(folder):
+            return
+        if not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                if not os.path.isdir(folder):
+                    raise
+        import tempfile
+        handle, tmp = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        with os.fdopen(handle, 'w') as entry:
+            json.dump(dict(stored=fetched, key=key, result=result), entry)
+        getattr(os, 'replace', os.rename)(tmp, os.path.join(folder, self.__name(key)))
+        if next(self.__puts) % 20 == 0:
+            self.evict()
+
+    def invalidate(self, host, category):
+        '''Drop every entry of a category'''
+        folder = self.__category_dir(host, category)
+        if not os.path.isdir(folder):
+            return
+        with open(os.path.join(folder, '.invalidated'), 'w'):
+            pass
+        for name in os.listdir(folder):
+            if name.endswith('.json'):
+                try:
+                    os.remove(os.path.join(folder, name))
+                except OSError:
+                    pass
+
+    def evict(self):
+        '''Remove the oldest entries until the cache fits in max_bytes'''
+        entries = list()
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.json'):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+class _Flight(object):
+    '''A call shared by every caller that asked for the same key while it ran'''
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    '''
+    run identical concurrent calls once and hand every caller the same result
+
+    With a ttl, results are also kept for ttl seconds and returned to later callers.
+
+    :param ttl: seconds a finished result is reused, 0 to only share running calls
+    :type ttl: float
+    '''
+    def __init__(self, ttl=0):
+        self.ttl = ttl
+        self.__lock = threading.Lock()
+        self.__running = dict()
+        self.__results = dict()
+        self.__stats = dict(calls=0, shared=0, cached=0)
+
+    def do(self, key, func, cacheable=None):
+        '''Return func(), sharing the call with concurrent callers passing the same key'''
+        with self.__lock:
+            self.__stats['calls'] += 1
+            if self.ttl and key in self.__results:
+                stored, result = self.__results[key]
+                if time.time() - stored <= self.ttl:
+                    self.__stats['cached'] += 1
+                    return result
+                del self.__results[key]
+            flight = self.__running.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.__running[key] = _Flight()
+            else:
+                self.__stats['shared'] += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = func()
+        except Exception as ex:
+            flight.error = ex
+            raise
+        finally:
+            with self.__lock:
+                del self.__running[key]
+                if self.ttl and flight.error is None and (cacheable is None or cacheable(flight.result)):
+                    now = time.time()
+                    for stale in [k for k, (stored, _) in self.__results.items() if now - stored > self.ttl]:
+                        del self.__results[stale]
+                    self.__results[key] = (now, flight.result)
+            flight.done.set()
+        return flight.result
+
+    def forget(self):
+        '''Drop every stored result'''
+        with self.__lock:
+            self.__results.clear()
+
+    def stats(self):
+        '''Return how many calls were made, shared with a running call or answered from stored results'''
+        with self.__lock:
+            return dict(self.__stats)
+
+
+class EventWriter(object):
+    '''
+    write behind queue for EventsRouter writes
+
+    Calls are queued and return a Future straight away. A background thread
+    sends them in batches of batch_size calls per request, or whatever is queued
+    once flush_interval seconds have passed. Every Future is resolved with the
+    result of its own call. Create writers with Zenoss.event_writer.
+    '''
+    def __init__(self, send, batch_size=100, flush_interval=1.0, max_queue=10000, block=True):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block = block
+        self.__send = send
+        self.__queue = queue.Queue(max_queue)
+        self.__closed = False
+        self.__thread = threading.Thread(target=self.__run, name='zenoss-event-writer')
+        self.__thread.daemon = True
+        self.__thread.start()
+        atexit.register(self.close)
+
+    def create_event_on_device(self, device_name, severity, summary, component='', evclasskey='', evclass=''):
+        '''Queue the creation of an event, see Zenoss.create_event_on_device'''
+        if severity not in EVENT_SEVERITIES:
+            raise Exception('Severity %s is not valid.' % severity)
+        data = dict(device=_device_name(device_name), summary=summary, severity=severity,
+                    component=component, evclasskey=evclasskey, evclass=evclass)
+        return self.__put('add_event', data)
+
+    def write_log(self, event_id, message):
+        '''Queue a message for an event's log, see Zenoss.write_log'''
+        return self.__put('write_log', dict(evid=event_id, message=message))
+
+    def __put(self, method, data):
+        '''Queue a call and return its Future'''
+        if self.__closed:
+            raise ZenossException('Event writer is closed')
+        from concurrent.futures import Future
+        future = Future()
+        try:
+            self.__queue.put((method, data, future), self.block)
+        except queue.Full:
+            raise ZenossException('Event writer queue is full')
+        return future
+
+    def flush(self, timeout=None):
+        '''Send everything queued so far and wait until it is delivered'''
+        done = threading.Event()
+        self.__queue.put((None, None, done))
+        return done.wait(timeout)
+
+    def close(self, timeout=None):
+        '''Send what is left and stop the background thread'''
+        if self.__closed:
+            return
+        self.__closed = True
+        self.flush(timeout)
+        self.__queue.put(None)
+        self.__thread.join(timeout)
+        if hasattr(atexit, 'unregister'):
+            atexit.unregister(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __run(self):
+        '''Collect queued calls into batches and send them'''
+        batch, markers = list(), list()
+        stop = False
+        while not stop:
+            deadline = None
+            while len(batch) < self.batch_size and not markers:
+                try:
+                    item = self.__queue.get(True, None if deadline is None else max(deadline - time.time(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                if item[0] is None:
+                    markers.append(item[2])
+                else:
+                    batch.append(item)
+                    if deadline is None:
+                        deadline = time.time() + self.flush_interval
+            if batch:
+                self.__deliver(batch)
+                batch = list()
+            for marker in markers:
+                marker.set()
+            markers = list()
+
+    def __deliver(self, batch):
+        '''Send one batch and resolve its futures'''
+        try:
+            results = self.__send('EventsRouter', [(method, [data]) for method, data, _ in batch])
+        except Exception as ex: # pylint: disable=W0703
+            log.error('Unable to deliver %s event writes: %s', len(batch), ex)
+            results = [ex] * len(batch)
+        for (_, _, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+class _TokenBucket(object):
+    '''Token bucket refilled at rate tokens per second, holding at most burst tokens'''
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(rate, 1))
+        self.tokens = self.burst
+        self.updated = time.time()
+
+    def delay(self, now):
+        '''Seconds until a token is available'''
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        '''Use up a token'''
+        self.tokens -= 1
+
+
+class RequestScheduler(object):
+    '''
+    rate limits router requests and sends them in priority order
+
+    A scheduler can be shared by several Zenoss clients talking to the same server.
+    Requests wait until fewer than max_in_flight requests are running and every token
+    bucket that applies has a token. The waiting request with the best priority goes
+    first, skipping requests that still wait for a token of their own router or method.
+
+    Reads default to PRIORITY_READ and writes to PRIORITY_WRITE, ahead of every read,
+    so jobs writing to many devices, such as mass remodels, should run inside
+    Zenoss.priority(PRIORITY_BULK) to leave room for interactive reads. Compound
+    calls such as reconcile_devices use PRIORITY_BULK unless told otherwise.
+
+    :param max_in_flight: maximum number of requests running at once
+    :type max_in_flight: int
+    :param rate: requests per second over all routers, None for no limit
+    :type rate: float
+    :param burst: requests allowed at once above rate
+    :type burst: int
+    :param limits: router name or (router, method) tuple mapped to a rate or a (rate, burst) tuple
+    :type limits: dict
+
+    usage::
+        >>> scheduler = RequestScheduler(max_in_flight=4, rate=20, limits={('DeviceRouter', 'remodel'): 1})
+        >>> zen = Zenoss('http://zenoss:8080/', 'admin', 'password', scheduler=scheduler)
+    '''
+    def __init__(self, max_in_flight=4, rate=None, burst=None, limits=None):
+        self.max_in_flight = max_in_flight
+        self.__cond = threading.Condition()
+        self.__waiting = list()
+        self.__seq = itertools.count()
+        self.__in_flight = 0
+        self.__global = _TokenBucket(rate, burst) if rate else None
+        self.__buckets = dict()
+        for key, limit in (limits or {}).items():
+            self.__buckets[key] = _TokenBucket(*limit) if isinstance(limit, tuple) else _TokenBucket(limit)
+        self.__stats = dict()
+
+    def acquire(self, router, method, priority=PRIORITY_READ):
+        '''Block until the request may be sent'''
+        buckets = [bucket for bucket in (self.__global, self.__buckets.get(router),
+                                         self.__buckets.get((router, method))) if bucket]
+        queued = time.time()
+        with self.__cond:
+            entry = (priority, next(self.__seq), buckets)
+            insort(self.__waiting, entry)
+            while True:
+                timeout = None
+                if self.__in_flight < self.max_in_flight:
+                    now = time.time()
+                    first = None
+                    for waiter in self.__waiting:
+                        delay = max([bucket.delay(now) for bucket in waiter[2]] or [0])
+                        if not delay:
+                            first = waiter
+                            break
+                        timeout = delay if timeout is None else min(timeout, delay)
+                    if first is entry:
+                        break
+                    if first is not None:
+                        # The request going first wakes everyone once it has left the queue
+                        timeout = None
+                self.__cond.wait(timeout)
+            self.__waiting.remove(entry)
+            for bucket in buckets:
+                bucket.take()
+            self.__in_flight += 1
+            waited = time.time() - queued
+            stats = self.__stats.setdefault(priority, dict(requests=0, wait_total=0.0, wait_max=0.0))
+            stats['requests'] += 1
+            stats['wait_total'] += waited
+            stats['wait_max'] = max(stats['wait_max'], waited)
+            self.__cond.notify_all()
+
+    def release(self):
+        '''Mark a request acquired earlier as finished'''
+        with self.__cond:
+            self.__in_flight -= 1
+            self.__cond.notify_all()
+
+    def stats(self):
+        '''
+        return queue depth, requests in flight and wait times per priority
+
+        usage::
+            >>> scheduler.stats()
+            {'queued': 12, 'in_flight': 4,
+             'priorities': {1: {'requests': 40, 'wait_total': 0.8, 'wait_max': 0.1, 'wait_avg': 0.02}, ...}}
+        '''
+        with self.__cond:
+            priorities = dict()
+            for priority, stats in self.__stats.items():
+                priorities[priority] = dict(stats, wait_avg=stats['wait_total'] / stats['requests'])
+            return dict(queued=len(self.__waiting), in_flight=self.__in_flight, priorities=priorities)
+
+
+class RetryPolicy(object):
+    '''
+    timeouts, retries and hedging for router requests
+
+    Only methods in READ_METHODS are retried or hedged, writes are always sent once.
+    Reads are retried after connection errors, timeouts and 502, 503 or 504 responses,
+    waiting a jittered exponential backoff, as long as a Zenoss.deadline allows it.
+    With hedge_after or hedge_percentile a read that has not answered in time is sent
+    a second time and whichever reply comes first is used.
+
+    :param retries: retries after the first attempt of a read
+    :type retries: int
+    :param backoff: longest wait before the first retry in seconds, doubled for every retry
+    :type backoff: float
+    :param max_backoff: longest wait before any retry in seconds
+    :type max_backoff: float
+    :param timeout: seconds to wait for the server on every attempt, None for no limit
+    :type timeout: float
+    :param hedge_after: seconds after which a read is sent again
+    :type hedge_after: float
+    :param hedge_percentile: send a read again once it is slower than this percentile of recent reads
+        of the same method, used when hedge_after is not given
+    :type hedge_percentile: float
+    :param hedge_workers: threads sending hedged reads
+    :type hedge_workers: int
+
+    usage::
+        >>> policy = RetryPolicy(retries=4, timeout=60, hedge_percentile=95)
+        >>> zen = Zenoss('http://zenoss:8080/', 'admin', 'password', retry_policy=policy)
+    '''
+    # Latencies kept per method and needed before hedge_percentile is used
+    window = 200
+    min_samples = 20
+
+    def __init__(self, retries=3, backoff=0.1, max_backoff=5.0, timeout=None, # pylint: disable=R0913
+                 hedge_after=None, hedge_percentile=None, hedge_workers=16):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.hedge_after = hedge_after
+        self.hedge_percentile = hedge_percentile
+        self.hedge_workers = hedge_workers
+        self.__lock = threading.Lock()
+        self.__latencies = dict()
+        self.__pool = None
+        self.__stats = dict(requests=0, retries=0, hedges=0, hedge_wins=0, deadline_exceeded=0)
+
+    def backoff_delay(self, attempt):
+        '''Seconds to wait before retrying after attempt number attempt, starting at 0'''
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def hedge_delay(self, method):
+        '''Seconds after which a read of method is sent again, None to not hedge it'''
+        if self.hedge_after is not None:
+            return self.hedge_after
+        if self.hedge_percentile is None:
+            return None
+        with self.__lock:
+            samples = sorted(self.__latencies.get(method, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * self.hedge_percentile / 100.0))]
+
+    def record(self, method, seconds):
+        '''Remember how long a read of method took'''
+        with self.__lock:
+            self.__stats['requests'] += 1
+            self.__latencies.setdefault(method, deque(maxlen=self.window)).append(seconds)
+
+    def count(self, name):
+        '''Add one to the counter name'''
+        with self.__lock:
+            self.__stats[name] += 1
+
+    def submit(self, func):
+        '''Run func on the hedging threads and return its Future'''
+        with self.__lock:
+            if self.__pool is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self.__pool = ThreadPoolExecutor(max_workers=self.hedge_workers)
+            return self.__pool.submit(func)
+
+    def stats(self):
+        '''
+        return how many reads were answered, retried and hedged, and how many hedges won
+
+        usage::
+            >>> policy.stats()
+            {'requests': 5000, 'retries': 3, 'hedges': 48, 'hedge_wins': 31, 'deadline_exceeded': 0}
+        '''
+        with self.__lock:
+            return dict(self.__stats)